@@ -1,11 +1,295 @@
 #! /usr/bin/env python3
-from picamera import PiCamera
-from time import sleep
+import asyncio
+import collections
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import REGISTRY
 
-camera = PiCamera()
-camera.vflip = True
+#how old a capture can be and still be handed to a new request
+FRESHNESS_SECS = 0.5
 
-def get_image():
-    im_path = '/home/pi/dudebot/media/image.jpg'
-    camera.capture(im_path)
-    return im_path
\ No newline at end of file
+#continuous capture from the video port, off unless started
+STREAM_FRAMERATE = 5.0
+STREAM_DEPTH = 10
+STREAM_MAX_FRAMERATE = 30.0
+STREAM_MAX_DEPTH = 100
+#how long a request waits for the first frame after streaming starts
+STREAM_FIRST_FRAME_SECS = 5.0
+
+FAKE_IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'image.jpg')
+
+
+#size and JPEG quality of what gets captured; resize None is the sensor's
+#full resolution
+class ImagePreset:
+    def __init__(self, resize, quality):
+        self.resize = resize
+        self.quality = quality
+
+
+PRESETS = {
+    'thumbnail': ImagePreset((320, 240), 60),
+    'chat': ImagePreset((1024, 768), 80),
+    'full': ImagePreset(None, 90),
+}
+DEFAULT_PRESET = 'chat'
+
+
+def get_preset(name):
+    if name not in PRESETS:
+        raise ValueError(f"Unknown image preset {name}, pick one of {', '.join(PRESETS)}")
+    return PRESETS[name]
+
+
+class PiCameraBackend:
+    """
+    The raspberry pi camera, capturing JPEGs into memory instead of a file.
+    """
+
+    def __init__(self, vflip=True):
+        self.vflip = vflip
+        self.camera = None
+        #opened from the capture executor or the stream thread
+        self.lock = threading.Lock()
+
+    #the camera takes a couple of seconds to come up, so this is also run
+    #in the background at startup
+    def open(self):
+        with self.lock:
+            if self.camera is None:
+                from picamera import PiCamera
+                self.camera = PiCamera()
+                self.camera.vflip = self.vflip
+        return self.camera
+
+    def capture(self, preset=PRESETS['full']):
+        buf = io.BytesIO()
+        #the camera scales and encodes on its GPU, far cheaper than doing it after
+        self.open().capture(buf, format='jpeg', resize=preset.resize, quality=preset.quality)
+        return buf.getvalue()
+
+    #JPEG frames from the video port for as long as they're consumed, without
+    #the still port's mode switch and exposure settling on every picture
+    def stream(self, preset, framerate):
+        camera = self.open()
+        camera.framerate = framerate
+        buf = io.BytesIO()
+        for _ in camera.capture_continuous(buf, format='jpeg', use_video_port=True,
+                resize=preset.resize, quality=preset.quality):
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+
+class FakeCamera:
+    """
+    Stands in for the pi camera off the Pi, returning a fixed JPEG after a
+    delay that mimics a still capture. Presets are ignored.
+    """
+
+    def __init__(self, path=FAKE_IMAGE_PATH, delay=0.3):
+        self.path = path
+        self.delay = delay
+        self.captures = 0
+        with open(path, 'rb') as file:
+            self.image = file.read()
+
+    def open(self):
+        pass
+
+    def capture(self, preset=None):
+        time.sleep(self.delay)
+        self.captures += 1
+        return self.image
+
+    def stream(self, preset, framerate):
+        while True:
+            time.sleep(1 / framerate)
+            self.captures += 1
+            yield self.image
+
+
+class FrameStream:
+    """
+    Captures continuously on its own thread, keeping the newest depth
+    frames in a ring buffer.
+    """
+
+    def __init__(self, backend, preset, framerate=STREAM_FRAMERATE, depth=STREAM_DEPTH):
+        self.backend = backend
+        self.preset = preset
+        self.framerate = framerate
+        #(monotonic secs, jpeg), oldest first
+        self.frames = collections.deque(maxlen=depth)
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.count = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='camera-stream', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for frame in self.backend.stream(self.preset, self.framerate):
+                with self.cond:
+                    self.frames.append((time.monotonic(), frame))
+                    self.count += 1
+                    self.cond.notify_all()
+                if not self.running:
+                    break
+        except Exception as e:
+            print(f"Camera stream stopped: {e}")
+        finally:
+            with self.cond:
+                self.running = False
+                self.cond.notify_all()
+
+    #the thread finishes after the frame it is on
+    def stop(self):
+        self.running = False
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def latest(self):
+        with self.cond:
+            return self.frames[-1][1] if self.frames else None
+
+    def last(self, n):
+        with self.cond:
+            return [frame for _, frame in list(self.frames)[-n:]]
+
+    #blocks until there is a frame or the stream stops
+    def wait(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.frames or not self.running, timeout)
+            return self.frames[-1][1] if self.frames else None
+
+
+class CaptureService:
+    """
+    Runs captures off the event loop and shares one capture between every
+    request for the same preset that arrives while it is running or within
+    the freshness window. While streaming, every request gets the newest
+    streamed frame instead.
+    """
+
+    def __init__(self, backend, freshness=FRESHNESS_SECS, executor=None):
+        self.backend = backend
+        self.freshness = freshness
+        #the camera can only do one capture at a time
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        #all by preset name
+        self.inflight = {}
+        self.last_image = {}
+        self.last_started = {}
+        self.stream = None
+
+    @property
+    def streaming(self):
+        return self.stream is not None and self.stream.running
+
+    async def start_stream(self, framerate=STREAM_FRAMERATE, depth=STREAM_DEPTH,
+                           preset=DEFAULT_PRESET):
+        if not 0 < framerate <= STREAM_MAX_FRAMERATE:
+            raise ValueError(f"Frame rate must be above 0 and at most {STREAM_MAX_FRAMERATE:g}")
+        if not 1 <= depth <= STREAM_MAX_DEPTH:
+            raise ValueError(f"Buffer depth must be between 1 and {STREAM_MAX_DEPTH}")
+        settings = get_preset(preset)
+        await self.stop_stream()
+        #a still capture still running would fight the stream for the camera
+        await asyncio.gather(*self.inflight.values(), return_exceptions=True)
+        self.stream = FrameStream(self.backend, settings, framerate, depth)
+        self.stream.start()
+
+    async def stop_stream(self):
+        if self.stream is None:
+            return
+        stream, self.stream = self.stream, None
+        stream.stop()
+        await asyncio.get_running_loop().run_in_executor(None, stream.join)
+
+    #the newest n streamed frames, oldest first
+    def burst(self, n):
+        if not self.streaming:
+            raise ValueError("The camera isn't streaming, start it first")
+        return self.stream.last(n)
+
+    #opens the camera on the capture thread without taking a picture
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.backend.open)
+
+    def _capture(self, preset):
+        with REGISTRY.timer("camera.capture"):
+            return self.backend.capture(preset)
+
+    def _done(self, name, fut):
+        del self.inflight[name]
+        if not fut.cancelled() and fut.exception() is None:
+            self.last_image[name] = fut.result()
+
+    async def capture(self, preset=DEFAULT_PRESET):
+        settings = get_preset(preset)
+        now = time.monotonic()
+        REGISTRY.incr("camera.requests")
+        if self.streaming:
+            frame = self.stream.latest()
+            if frame is None:
+                loop = asyncio.get_running_loop()
+                frame = await loop.run_in_executor(None, self.stream.wait, STREAM_FIRST_FRAME_SECS)
+            if frame is not None:
+                REGISTRY.incr("camera.streamed")
+                return frame
+        if preset not in self.inflight:
+            if preset in self.last_image and now - self.last_started[preset] <= self.freshness:
+                REGISTRY.incr("camera.shared")
+                return self.last_image[preset]
+            loop = asyncio.get_running_loop()
+            self.last_started[preset] = now
+            fut = loop.run_in_executor(self.executor, self._capture, settings)
+            fut.add_done_callback(lambda f: self._done(preset, f))
+            self.inflight[preset] = fut
+        else:
+            REGISTRY.incr("camera.shared")
+        #shielded so one cancelled caller doesn't cancel everyone's capture
+        return await asyncio.shield(self.inflight[preset])
+
+
+capture_service = CaptureService(PiCameraBackend())
+
+
+#returns the bytes of a JPEG from the pi camera
+async def get_image(preset=DEFAULT_PRESET):
+    return await capture_service.capture(preset)
+
+
+async def _bench(n, freshness):
+    camera = FakeCamera()
+    service = CaptureService(camera, freshness=freshness)
+    start = time.perf_counter()
+    for _ in range(n):
+        camera.capture()
+    serial = time.perf_counter() - start
+
+    camera.captures = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(service.capture() for _ in range(n)))
+    shared = time.perf_counter() - start
+    print(f"{n} requests, one capture each: {serial:.2f}s")
+    print(f"{n} requests, coalesced: {shared:.2f}s ({camera.captures} captures)")
+
+
+def main():
+    asyncio.run(_bench(20, FRESHNESS_SECS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import collections
+import time
+
+
+DEFAULT_WINDOW_SECS = 120.0
+DEFAULT_MAX_ENTRIES = 4096
+
+# the request is still running, there's no response to hand out yet
+PENDING = "pending"
+# seen and deliberately left unanswered
+IGNORED = "ignored"
+
+
+class SeenCache:
+    """
+    Ids of the requests handled in the last window secs, at most
+    max_entries of them, with the response sent for each so a request that
+    arrives again gets the same answer instead of running twice.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW_SECS, max_entries=DEFAULT_MAX_ENTRIES,
+                 clock=time.monotonic):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        # id -> [first seen, response], oldest first since nothing is moved
+        self.entries = collections.OrderedDict()
+        self.duplicates = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def check(self, packet_id):
+        """
+        Returns None the first time an id turns up, and what was recorded
+        for it on every later one.
+        """
+        now = self.clock()
+        self.evict(now)
+        entry = self.entries.get(packet_id)
+        if entry is not None:
+            self.duplicates += 1
+            return entry[1]
+        self.entries[packet_id] = [now, PENDING]
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+        return None
+
+    def record(self, packet_id, response):
+        entry = self.entries.get(packet_id)
+        if entry is not None:
+            entry[1] = response
+
+    # for requests that never ran, so trying them again is harmless
+    def forget(self, packet_id):
+        self.entries.pop(packet_id, None)
+
+    def evict(self, now=None):
+        cutoff = (self.clock() if now is None else now) - self.window
+        while self.entries:
+            first = next(iter(self.entries.values()))
+            if first[0] >= cutoff:
+                break
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        self.evict()
+        return {
+            "entries": len(self.entries),
+            "duplicates": self.duplicates,
+            "evicted": self.evicted,
+        }
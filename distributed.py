@@ -2,24 +2,49 @@
 import os
 import socket
 import uuid
-from datetime import datetime, timedelta
 from enum import Enum
-from dataclasses import dataclass, field, asdict
-import json
+from dataclasses import dataclass, field, fields, asdict
 import logging
 import discord
 from discord.ext import commands, tasks
-import collections
 import asyncio
 import randomname
+import wire
+from transport import DiscordTransport
+import packetstore
+from packetstore import PacketStore
+import responsecache
+from responsecache import ResponseCache, body_key
+import peers
+from peers import PeerRegistry, rendezvous_rank
+import dedup
+from dedup import SeenCache
+from metrics import REGISTRY
 
 NODE_COMMS_CHANNEL_ID = 1128171384422551656
 
 EVERYONE_WILDCARD = "#everyone"
 ANYONE_WILDCARD = "#anyone"
 DISCOVERY_ENDPOINT = "/ping"
+# heartbeats are /ping packets with this backlink, so nobody answers them
+HEARTBEAT_BACKLINK = "#heartbeat"
+# don't send heartbeats closer together than this, however many peers turn up
+HEARTBEAT_MIN_GAP_SECS = 1.0
 NODE_COG_NAME = "Node"
 
+DEFAULT_CALL_TIMEOUT_SECS = 5.0
+DEFAULT_ENDPOINT_QUEUE_SIZE = 8
+# how many answers a wildcard call waits for before any peers are known
+DEFAULT_WILDCARD_WAIT_FOR_N = 100
+# peers an #anyone call is sent to in turn before giving up, each one
+# getting the full timeout
+ANYONE_MAX_ATTEMPTS = 3
+
+# how long callers may reuse an answer from the built in endpoints
+PING_CACHE_TTL_SECS = 10.0
+ENDPOINT_INFO_CACHE_TTL_SECS = 60.0
+ADD_CACHE_TTL_SECS = 300.0
+
 
 @dataclass()
 class Packet:
@@ -29,6 +54,60 @@ class Packet:
     endpoint: str = ""
     body: dict = field(default_factory=dict)
     backlink: str = ""
+    # secs the receiver may cache this response for, 0 for not at all
+    ttl: float = 0
+
+
+class PendingCall:
+    """
+    A request waiting on responses, resolved by Node.on_message as soon as
+    the expected number of responders have answered.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.responses = []
+        self.seen = set()
+        self.done = asyncio.get_running_loop().create_future()
+        if expected <= 0:
+            self.done.set_result(None)
+
+    def add(self, packet):
+        if packet.id in self.seen:
+            return
+        self.seen.add(packet.id)
+        self.responses.append(packet)
+        if len(self.responses) >= self.expected and not self.done.done():
+            self.done.set_result(None)
+
+
+class EndpointLimit:
+    """
+    How many calls of one endpoint may run at once (None for no limit),
+    and how many more may wait for a slot before callers are turned away.
+    """
+
+    def __init__(self, concurrency=None, queue_size=DEFAULT_ENDPOINT_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.active = 0 # running plus waiting
+
+    def full(self):
+        if self.concurrency is None:
+            return False
+        return self.active >= self.concurrency + self.queue_size
+
+    def try_reserve(self):
+        # taken when the packet arrives, before the task runs, so a burst
+        # can't all slip in ahead of the first call starting
+        if self.full():
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
 
 
 def make_packet(caller_id, dst, endpoint, **body):
@@ -41,6 +120,16 @@ def make_packet(caller_id, dst, endpoint, **body):
     return p
 
 
+# the shortest ttl of the responses, or None if any of them can't be cached
+def responses_ttl(responses):
+    if not responses:
+        return None
+    for p in responses:
+        if not p.ttl or "error" in p.body:
+            return None
+    return min(p.ttl for p in responses)
+
+
 def make_response_packet(caller_id, inp: Packet, **body):
     p = Packet()
     p.body = body
@@ -52,14 +141,24 @@ def make_response_packet(caller_id, inp: Packet, **body):
     return p
 
 
-def cast_to_packet(text: str):
+PACKET_FIELDS = [f.name for f in fields(Packet)]
+
+
+def fields_to_packet(d):
     try:
-        d = json.loads(text)
-        return Packet(**d)
+        # fields added by newer nodes are ignored rather than rejected
+        return Packet(**{k: v for k, v in d.items() if k in PACKET_FIELDS})
     except Exception as e:
         return None
 
 
+def cast_to_packet(text: str):
+    d = wire.decode(text)
+    if not isinstance(d, dict):
+        return None
+    return fields_to_packet(d)
+
+
 def get_cog_or_throw(bot, cog_name):
     cog = bot.get_cog(cog_name)
     if not cog:
@@ -74,19 +173,34 @@ def bad_endpoint_body(caller_id, ep):
     }
 
 
-async def endpoint_ping(node_iface, **args):
-    """
-    args: none
-    returns: node information
-    """
+def node_info(node_iface):
     return {
         "hostname": socket.gethostname(),
         "pid": os.getpid(),
         "instance": node_iface.instance_uuid,
-        "endpoints": list(node_iface.endpoints.keys())
+        "endpoints": list(node_iface.endpoints.keys()),
+        # safe to run twice, so callers may retry them elsewhere
+        "idempotent": node_iface.idempotent_endpoints,
+        "load": sum(l.active for l in node_iface.endpoint_limits.values())
     }
 
 
+async def endpoint_ping(node_iface, **args):
+    """
+    args: none
+    returns: node information
+    """
+    return node_info(node_iface)
+
+
+async def endpoint_peers(node_iface, **args):
+    """
+    args: none
+    returns: the live peers this node knows of and what they serve
+    """
+    return node_iface.peers.snapshot()
+
+
 async def endpoint_add(node_iface, **args):
     """
     args: x, y, z
@@ -103,6 +217,14 @@ async def endpoint_camera(node_iface, **args):
     return {"result": "OK"}
 
 
+async def endpoint_packets(node_iface, **args):
+    """
+    args: none
+    returns: packet buffer size and eviction counters
+    """
+    return node_iface.packet_buffer.stats()
+
+
 async def endpoint_ep_info(node_iface, **args):
     """
     args: endpoint
@@ -117,6 +239,20 @@ async def endpoint_ep_info(node_iface, **args):
     return {"endpoint": ep, "funcname": func.__name__, "doc": doclines}
 
 
+async def endpoint_metrics(node_iface, **args):
+    """
+    args: prefix (optional)
+    returns: uptime, counters and latency percentiles for this node
+    """
+    snap = REGISTRY.snapshot(args.get("prefix", ""))
+    snap["hostname"] = socket.gethostname()
+    snap["packets"] = node_iface.packet_buffer.stats()
+    snap["response_cache"] = node_iface.response_cache.stats()
+    snap["memo"] = node_iface.memo.stats()
+    snap["seen"] = node_iface.seen.stats()
+    return snap
+
+
 def should_respond(caller_id, packet: Packet):
     if packet.backlink:
         return False
@@ -128,14 +264,29 @@ def should_respond(caller_id, packet: Packet):
            packet.dst == ANYONE_WILDCARD
 
 
+def overloaded_body(caller_id, ep):
+    return {
+        "error": f"Endpoint {ep} is busy on node {caller_id}, try again later",
+        "error_type": "Overloaded"
+    }
+
+
+# discord rejects embeds with more fields or longer values than this
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_VALUE_CHARS = 1024
+
+
 def packet_to_embed(p):
 
     c = discord.Color.blue()
     if "error" in p.body:
         c = discord.Color.red()
     embed = discord.Embed(title=f"[{p.endpoint}] {p.src} -> {p.dst}", color=c)
-    for k, v in p.body.items():
-        embed.add_field(name=str(k), value=str(v))
+    for k, v in list(p.body.items())[:EMBED_MAX_FIELDS]:
+        v = str(v)
+        if len(v) > EMBED_MAX_VALUE_CHARS:
+            v = v[:EMBED_MAX_VALUE_CHARS - 3] + "..."
+        embed.add_field(name=str(k)[:256], value=v)
     footer = f"{p.id}"
     if p.backlink:
         footer += f"\n{p.backlink}"
@@ -143,12 +294,12 @@ def packet_to_embed(p):
     return embed
 
 
-def register_endpoint(bot, name, func):
+def register_endpoint(bot, name, func, **kwargs):
     node_iface = bot.get_cog(NODE_COG_NAME)
     if not node_iface:
         print(f"Failed to register endpoint {name}")
     else:
-        node_iface.register_endpoint(name, func)
+        node_iface.register_endpoint(name, func, **kwargs)
 
 
 class Node(commands.Cog):
@@ -157,14 +308,52 @@ class Node(commands.Cog):
     def __init__(self, bot, **kwargs):
         self.bot = bot
         self.comms_channel = None
+        self.discord_transport = None
+        # fastest first, see transport.py
+        self.transports = []
         self.endpoints = {}
+        self.endpoint_limits = {}
+        self.tasks = set()
         self.instance_uuid = str(uuid.uuid4())
         self.caller_id = kwargs.get("callerid", randomname.get_name())
-        self.packet_buffer = collections.deque()
-
-        self.register_endpoint("/ping",     endpoint_ping)
-        self.register_endpoint("/add",      endpoint_add)
-        self.register_endpoint("/endpoint", endpoint_ep_info)
+        self.packet_buffer = PacketStore(
+            max_age=kwargs.get("buffer_max_age", packetstore.DEFAULT_MAX_AGE_SECS),
+            max_count=kwargs.get("buffer_max_count", packetstore.DEFAULT_MAX_COUNT),
+            max_bytes=kwargs.get("buffer_max_bytes", packetstore.DEFAULT_MAX_BYTES))
+        self.pending = {}
+        self.reassembler = wire.Reassembler()
+        # "json" keeps talking the legacy format while old nodes are still around
+        self.wire_format = kwargs.get("wire_format", "compact")
+        # answers this node got from others, and results of its pure endpoints
+        cache_max = kwargs.get("cache_max_entries", responsecache.DEFAULT_MAX_ENTRIES)
+        self.response_cache = ResponseCache(cache_max)
+        self.memo = ResponseCache(cache_max)
+        self.endpoint_ttls = {}
+        self.pure_endpoints = set()
+        # kept up to date by register_endpoint, it goes out with every /ping
+        self.idempotent_endpoints = []
+        # who is out there, for knowing how many answers a wildcard call gets
+        self.heartbeat_secs = kwargs.get("heartbeat_secs", peers.HEARTBEAT_SECS)
+        self.peers = PeerRegistry(kwargs.get("peer_ttl", peers.PEER_TTL_SECS))
+        self.last_heartbeat = 0.0
+        # calls this node is waiting on, by the peer it sent them to
+        self.inflight = {}
+        # requests already handled, so one delivered twice doesn't run twice
+        self.seen = SeenCache(
+            window=kwargs.get("dedup_window", dedup.DEFAULT_WINDOW_SECS),
+            max_entries=kwargs.get("dedup_max_entries", dedup.DEFAULT_MAX_ENTRIES))
+        self.heartbeat.change_interval(seconds=self.heartbeat_secs)
+
+        for t in kwargs.get("transports", []):
+            self.add_transport(t)
+
+        self.register_endpoint("/ping",     endpoint_ping, cache_ttl=PING_CACHE_TTL_SECS)
+        self.register_endpoint("/add",      endpoint_add, cache_ttl=ADD_CACHE_TTL_SECS, pure=True)
+        self.register_endpoint("/endpoint", endpoint_ep_info,
+                               cache_ttl=ENDPOINT_INFO_CACHE_TTL_SECS, pure=True)
+        self.register_endpoint("/packets",  endpoint_packets)
+        self.register_endpoint("/metrics",  endpoint_metrics)
+        self.register_endpoint("/peers",    endpoint_peers)
 
 
     @commands.command()
@@ -178,12 +367,16 @@ class Node(commands.Cog):
                 continue
             body[k] = v
 
-        wait_for_n = 1
-        if dst == EVERYONE_WILDCARD or dst == ANYONE_WILDCARD:
-            wait_for_n = 100
+        timeout = DEFAULT_CALL_TIMEOUT_SECS
+        if "timeout" in body:
+            timeout = float(body.pop("timeout"))
+
+        # nocache=1 skips any cached answer and asks again
+        use_cache = body.pop("nocache", "0") in ("0", "false", "no")
 
         await ctx.send(f"Calling {endpoint} on {dst} with args {body}...")
-        packets = await self.call_endpoint(dst, endpoint, wait_for_n, **body)
+        packets = await self.call_endpoint(dst, endpoint, timeout=timeout,
+                                           use_cache=use_cache, **body)
         for p in packets:
             e = packet_to_embed(p)
             await ctx.send(embed=e)
@@ -191,47 +384,255 @@ class Node(commands.Cog):
             await ctx.send("No response.")
 
 
-    async def send_packet(self, packet):
+    @commands.command()
+    async def uncache(self, ctx, dst=None, endpoint=None):
+        n = self.invalidate_cache(dst, endpoint)
+        await ctx.send(f"Dropped {n} cached responses.")
+
+
+    def encode_packet(self, packet, wire_format=None):
+        if (wire_format or self.wire_format) == "json":
+            # legacy nodes reject fields they don't know, and don't cache anyway
+            d = asdict(packet)
+            del d["ttl"]
+            return wire.encode_json(d)
+        return wire.encode(asdict(packet))
+
+
+    def add_transport(self, transport):
+        transport.attach(self.caller_id, self.handle_text)
+        self.transports.append(transport)
+        self.transports.sort(key=lambda t: t.priority)
+
+
+    async def start_transports(self):
+        for t in self.transports:
+            await t.start()
+
+
+    async def cog_load(self):
+        await self.start_transports()
+        self.heartbeat.start()
+
+
+    async def cog_unload(self):
+        self.heartbeat.cancel()
+
+
+    @tasks.loop(seconds=peers.HEARTBEAT_SECS)
+    async def heartbeat(self):
+        # an exception would stop the loop for good
+        try:
+            await self.send_heartbeat()
+        except Exception as e:
+            print(f"Failed to send heartbeat: {e}")
+
+
+    async def send_heartbeat(self):
+        info = node_info(self)
+        # counted straight away, not every transport hands our own packets back
+        self.peers.seen(self.caller_id, info)
+        if not self.transports:
+            return
+        self.last_heartbeat = asyncio.get_running_loop().time()
+        p = make_packet(self.caller_id, EVERYONE_WILDCARD, DISCOVERY_ENDPOINT, **info)
+        p.backlink = HEARTBEAT_BACKLINK
+        await self.send_packet(p)
+
+
+    # lets a peer that just showed up hear about us without waiting a full interval
+    async def heartbeat_soon(self):
+        if asyncio.get_running_loop().time() - self.last_heartbeat >= HEARTBEAT_MIN_GAP_SECS:
+            await self.send_heartbeat()
+
+
+    def expected_responders(self, dst, endpoint):
+        if dst != EVERYONE_WILDCARD:
+            # a named peer, or an #anyone broadcast that one node takes on
+            return 1
+        # peers without the endpoint still answer, with an error
+        responders = self.peers.live()
+        if not any(p.caller_id != self.caller_id for p in responders):
+            # we count ourselves from the start, but until another node has
+            # been heard from there's no idea who is out there
+            return DEFAULT_WILDCARD_WAIT_FOR_N
+        return len(responders)
+
+
+    # live peers that would answer an #anyone call for endpoint from src
+    def candidates(self, endpoint, src):
+        return [p for p in self.peers.with_endpoint(endpoint) if p.caller_id != src]
+
+
+    # whether this node is the one that should take an #anyone packet; it
+    # only goes by what peers reported, so every node comes to the same answer
+    def elected(self, p):
+        candidates = self.candidates(p.endpoint, p.src)
+        if not any(c.caller_id == self.caller_id for c in candidates):
+            # we don't know enough about the fleet yet, better twice than never
+            return True
+        return rendezvous_rank(p.id, candidates)[0].caller_id == self.caller_id
+
+
+    # the peers for an #anyone call, best first, counting calls we already
+    # have waiting on each peer on top of what it last reported
+    def rank_responders(self, p):
+        candidates = self.candidates(p.endpoint, self.caller_id)
+        ranked = rendezvous_rank(p.id, candidates,
+            load=lambda c: c.load + self.inflight.get(c.caller_id, 0))
+        return [c.caller_id for c in ranked]
+
+
+    def broadcast_transport(self):
+        # the comms channel reaches every node, otherwise take the widest
+        return self.discord_transport or self.transports[-1]
+
+
+    def route(self, dst):
+        if dst != EVERYONE_WILDCARD and dst != ANYONE_WILDCARD:
+            for t in self.transports:
+                if t.reaches(dst):
+                    return t
+        return self.broadcast_transport()
+
+
+    # wire_format overrides the node's own, to answer a legacy node in json;
+    # those go out one per message since old nodes can't split a batch
+    async def send_packet(self, packet, wire_format=None):
         # print(f"SEND: {packet}")
-        await self.comms_channel.send(json.dumps(asdict(packet)))
+        wire_format = wire_format or self.wire_format
+        texts = self.encode_packet(packet, wire_format)
+        t = self.route(packet.dst)
+        batch = wire_format != "json"
+        await asyncio.gather(*(t.send(text, packet.dst, batch) for text in texts))
+
+
+    async def send_and_await_responses(self, packet, wait_for_n=1,
+                                       timeout=DEFAULT_CALL_TIMEOUT_SECS):
+        # registered before sending so a fast response can't slip past
+        pending = PendingCall(wait_for_n)
+        self.pending[packet.id] = pending
+        try:
+            with REGISTRY.timer("call." + packet.endpoint):
+                await self.send_packet(packet)
+                try:
+                    await asyncio.wait_for(pending.done, timeout)
+                except asyncio.TimeoutError:
+                    REGISTRY.incr("call." + packet.endpoint + ".timeouts")
+        finally:
+            del self.pending[packet.id]
+        return pending.responses
+
+
+    async def call_endpoint(self, dst, endpoint, wait_for_n=None,
+                            timeout=DEFAULT_CALL_TIMEOUT_SECS, use_cache=True, **body):
+        # answered from the cache if every responder said it could be, a
+        # call with use_cache=False always goes out but still refreshes it
+        key = (dst, endpoint, body_key(body))
+        if use_cache:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                REGISTRY.incr("call." + endpoint + ".cached")
+                return list(cached)
+        p = make_packet(self.caller_id, dst, endpoint, **body)
+        responses = None
+        if dst == ANYONE_WILDCARD and wait_for_n is None:
+            wait_for_n = 1
+            responses = await self.call_anyone(p, timeout)
+        if responses is None:
+            if wait_for_n is None:
+                wait_for_n = self.expected_responders(dst, endpoint)
+            responses = await self.send_and_await_responses(p, wait_for_n, timeout)
+        # a call that timed out short has only part of the answer
+        ttl = responses_ttl(responses)
+        if ttl and len(responses) >= wait_for_n:
+            self.response_cache.put(key, list(responses), ttl)
+        return responses
 
 
-    async def send_and_await_responses(self, packet, wait_for_n=1):
-        pid = packet.id
-        await self.send_packet(packet)
-        start = datetime.now()
-        timeout = timedelta(seconds=5) # TODO make this configurable
-        dt = 0.1 # seconds
-        grabbed = set()
+    async def call_anyone(self, p, timeout):
+        """
+        Sends an #anyone call straight to one peer at a time, best ranked
+        first, so exactly one does the work. A timeout alone doesn't mean
+        the peer is gone, it may still be running a slow call, so the next
+        peer is only tried if the silent one stopped heartbeating or said
+        the endpoint is safe to run twice.
+        Returns None when there is no peer to ask, for a broadcast instead.
+        """
+        ranked = self.rank_responders(p)
+        if not ranked:
+            return None
         responses = []
-        while len(responses) < wait_for_n and datetime.now() < start + timeout:
-            for time, packet in self.packet_buffer:
-                if packet.backlink == pid and packet.id not in grabbed:
-                    responses.append(packet)
-                    grabbed.add(packet.id)
-            if len(responses) < wait_for_n:
-                await asyncio.sleep(dt)
+        for target in ranked[:ANYONE_MAX_ATTEMPTS]:
+            # a fresh id, so a late answer to an earlier attempt isn't confused with it
+            q = make_packet(self.caller_id, target, p.endpoint, **p.body)
+            self.inflight[target] = self.inflight.get(target, 0) + 1
+            try:
+                responses = await self.send_and_await_responses(q, 1, timeout)
+            finally:
+                self.inflight[target] -= 1
+                if not self.inflight[target]:
+                    del self.inflight[target]
+            if responses:
+                break
+            peer = self.peers.get(target)
+            if peer is not None and p.endpoint not in peer.idempotent:
+                break
+            print(f"No response from {target}, trying the next peer")
         return responses
 
 
-    async def call_endpoint(self, dst, endpoint, wait_for_n, **body):
-        p = make_packet(self.caller_id, dst, endpoint, **body)
-        return await self.send_and_await_responses(p, wait_for_n)
+    def invalidate_cache(self, dst=None, endpoint=None):
+        return self.response_cache.invalidate(
+            lambda k: (dst is None or k[0] == dst) and (endpoint is None or k[1] == endpoint))
 
 
-    def register_endpoint(self, name, func):
+    def register_endpoint(self, name, func, concurrency=None,
+                          queue_size=DEFAULT_ENDPOINT_QUEUE_SIZE,
+                          cache_ttl=None, pure=False):
+        """
+        cache_ttl lets callers reuse a response for that many secs, and a
+        pure endpoint, whose result only depends on its args, is also only
+        run once per args here until the ttl runs out (or ever, without one).
+        """
         print(f"Registering endpoint {name}")
         self.endpoints[name] = func
+        self.endpoint_limits[name] = EndpointLimit(concurrency, queue_size)
+        self.endpoint_ttls[name] = cache_ttl or 0
+        if pure:
+            self.pure_endpoints.add(name)
+        else:
+            self.pure_endpoints.discard(name)
+        self.idempotent_endpoints = sorted(n for n in self.endpoints
+            if self.endpoint_ttls[n] or n in self.pure_endpoints)
+        # endpoint info changes along with the endpoints
+        self.memo.invalidate()
+
 
+    async def send_file(self, fp, filename=None):
+        # only the comms channel can host attachments
+        return await self.discord_transport.send_file(discord.File(fp, filename=filename))
 
-    async def send_file(self, filename):
-        m = await self.comms_channel.send(file=discord.File(filename))
-        return m.attachments[0].url
+
+    # (fp, filename) pairs, sent in a single message, returns their urls
+    async def send_files(self, files):
+        return await self.discord_transport.send_files(
+            [discord.File(fp, filename=filename) for fp, filename in files])
+
+
+    def attach_comms_channel(self, channel):
+        self.comms_channel = channel
+        # legacy json nodes don't know how to split a batched message
+        if self.discord_transport is None:
+            self.discord_transport = DiscordTransport(
+                channel, batch=self.wire_format != "json")
+            self.add_transport(self.discord_transport)
 
 
     @commands.Cog.listener()
     async def on_ready(self):
-        self.comms_channel = self.bot.get_channel(NODE_COMMS_CHANNEL_ID)
+        self.attach_comms_channel(self.bot.get_channel(NODE_COMMS_CHANNEL_ID))
+        await self.heartbeat_soon()
         print("Logged into node communications channel #" \
             f"{self.comms_channel} as \"{self.caller_id}\"")
 
@@ -239,42 +640,134 @@ class Node(commands.Cog):
     @commands.Cog.listener()
     async def on_message(self, message):
 
-        if message.channel != self.comms_channel:
+        if message.channel != self.comms_channel or not self.discord_transport:
            return
 
-        p = cast_to_packet(message.content)
+        await self.discord_transport.deliver_message(message.content)
+
+
+    async def handle_text(self, text):
+
+        decoded = self.reassembler.feed(text)
+        if not decoded:
+            return
 
+        d, size = decoded
+        p = fields_to_packet(d) if isinstance(d, dict) else None
         if not p:
             return
+        # requests are answered in the format they came in, so nodes that
+        # only speak json keep working while the fleet is upgraded
+        reply_format = "json" if wire.is_json(text) else self.wire_format
 
-        now = datetime.now()
-        self.packet_buffer.append((now, p))
-        while self.packet_buffer[0][0] < now - timedelta(60):
-            print(f"Popping old packet: {self.packet_buffer[0][1]}")
-            self.packet_buffer.popleft()
+        self.packet_buffer.add(p, size)
+
+        # heartbeats and /ping answers say what a peer serves, anything
+        # else from it at least shows it is still alive
+        if p.endpoint == DISCOVERY_ENDPOINT and "instance" in p.body and "error" not in p.body:
+            if self.peers.seen(p.src, p.body) and p.src != self.caller_id:
+                self.spawn(self.heartbeat_soon())
+        else:
+            self.peers.seen(p.src)
 
         # if p.src != self.caller_id:
         #     print(f"RECV: {p}")
 
+        if p.backlink in self.pending:
+            self.pending[p.backlink].add(p)
+
         if not should_respond(self.caller_id, p):
             return
 
+        # a redelivered request gets the answer it got the first time, or
+        # nothing while that is still being worked out
+        previous = self.seen.check(p.id)
+        if previous is not None:
+            REGISTRY.incr("packets.duplicate")
+            if isinstance(previous, Packet):
+                await self.send_packet(previous, reply_format)
+            return
+
         if not p.endpoint in self.endpoints:
             if p.dst != ANYONE_WILDCARD:
+                REGISTRY.incr("endpoint.bad")
                 resp = bad_endpoint_body(self.caller_id, p.endpoint)
                 q = make_response_packet(self.caller_id, p, **resp)
-                await self.send_packet(q)
+                await self.respond(p, q, reply_format)
+            else:
+                self.seen.record(p.id, dedup.IGNORED)
+            return
+
+        if p.dst == ANYONE_WILDCARD and not self.elected(p):
+            REGISTRY.incr("endpoint." + p.endpoint + ".deferred")
+            self.seen.record(p.id, dedup.IGNORED)
+            return
+
+        if p.endpoint in self.pure_endpoints:
+            resp = self.memo.get((p.endpoint, body_key(p.body)))
+            if resp is not None:
+                REGISTRY.incr("endpoint." + p.endpoint + ".memoized")
+                await self.respond(p, self.response_packet(p, resp), reply_format)
+                return
+
+        limit = self.endpoint_limits[p.endpoint]
+        if not limit.try_reserve():
+            REGISTRY.incr("endpoint." + p.endpoint + ".overloaded")
+            # it never ran, so it may as well be tried again if it comes back
+            self.seen.forget(p.id)
+            resp = overloaded_body(self.caller_id, p.endpoint)
+            q = make_response_packet(self.caller_id, p, **resp)
+            await self.send_packet(q, reply_format)
             return
 
+        # run as a task so a slow endpoint doesn't hold up later packets
+        self.spawn(self.run_endpoint(p, limit, reply_format))
+
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+
+    async def call_func(self, p):
         print(f"[{p.endpoint}] [{p.src} -> {p.dst}]")
         func = self.endpoints[p.endpoint]
         try:
-            resp = await func(self, **p.body)
+            with REGISTRY.timer("endpoint." + p.endpoint):
+                return await func(self, **p.body)
         except Exception as e:
-            resp = {
+            return {
                 "error": f"{e}",
                 "error_type": f"{type(e).__name__}",
                 "hostname": socket.gethostname()
             }
+
+
+    async def run_endpoint(self, p, limit, reply_format=None):
+        try:
+            if limit.semaphore:
+                async with limit.semaphore:
+                    resp = await self.call_func(p)
+            else:
+                resp = await self.call_func(p)
+        finally:
+            limit.release()
+        if p.endpoint in self.pure_endpoints and "error" not in resp:
+            self.memo.put((p.endpoint, body_key(p.body)), resp,
+                          self.endpoint_ttls[p.endpoint] or None)
+        await self.respond(p, self.response_packet(p, resp), reply_format)
+
+
+    # sends the response to p, keeping it for if p is delivered again
+    async def respond(self, p, q, reply_format=None):
+        self.seen.record(p.id, q)
+        await self.send_packet(q, reply_format)
+
+
+    def response_packet(self, p, resp):
         q = make_response_packet(self.caller_id, p, **resp)
-        await self.send_packet(q)
\ No newline at end of file
+        if "error" not in resp:
+            q.ttl = self.endpoint_ttls.get(p.endpoint, 0)
+        return q
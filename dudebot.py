@@ -1,154 +1,105 @@
 #! /usr/bin/env python3
+import time
+#taken before the other imports so the startup report covers them too
+STARTED = time.perf_counter()
 import discord
 from discord.ext import commands
 import os
-import requests
-import json
+import io
 import random
 import asyncio
-import RPi.GPIO as GPIO
 import morse
+import hardware
+import macros
+import camcontrol
+import metrics
+import motion
+import quotes
+import replies
+import triggers
+import uploads
 from camcontrol import get_image
 from states import get_param, set_param
 import distributed
+from transport import DirectTransport
 #from servotest import turn_servo
 
+MEDIA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')
+BIGDANCE_PATH = os.path.join(MEDIA_DIR, 'big-dance.gif')
+MONKEYTYPE_PATH = os.path.join(MEDIA_DIR, 'monkey type.jpg')
+#discord takes at most 10 files per message
+MAX_BURST = 10
 
-async def main():
-	print('Starting up DudeBot...')
 
-	#list of trigger words for dudebot to auto respond to
-	opinions = [
-		"opinion",
-		"think",
-		"assessment",
-		"assumption",
-		"attitude",
-		"conclusion",
-		"feeling",
-		"idea",
-		"impression",
-		"judgement",
-		"mind",
-		"notion",
-		"pov",
-		"POV",
-		"reaction",
-		"sentiment",
-		"speculate",
-		"speculation",
-		"theory",
-		"thought",
-		"view",
-		"viewpoint"
-	]
-
-	big = [
-		"big",
-		"large",
-		"huge",
-		"ginormous",
-		"colossal",
-		"considerable",
-		"enormous",
-		"fat",
-		"full",
-		"gigantic",
-		"hefty",
-		"immense",
-		"massive",
-		"sizable",
-		"substantial",
-		"tremendous",
-		"vast",
-		"obese",
-		"lorge",
-		"rotund",
-		"gargantuan"
-	]
-
-	#sets up pins for RGB LED light
-	RED_PIN = 17
-	GREEN_PIN = 27
-	BLUE_PIN = 22
-
-	#pin for arm servo signals
-	#arm servos are numbered, 1 for manipulator to 6 for base
-	SERVO1_PIN = 14
-	SERVO2_PIN = 15
-	SERVO3_PIN = 18
-	SERVO4_PIN = 23
-	SERVO5_PIN = 24
-	SERVO6_PIN = 25
-
-	#if the servo receives a duty cycle of 0, it holds position
-	SERVO_DO_NOTHING_DUTY = 0
-
-	#uses broadcom pin names instead of board names
-	GPIO.setmode(GPIO.BCM)
-
-	#turns off warnings and clears all previous GPIO states
-	GPIO.setwarnings(False)
-	GPIO.cleanup()
-
-	#establishes pins as output
-	GPIO.setup(RED_PIN, GPIO.OUT)
-	GPIO.setup(GREEN_PIN, GPIO.OUT)
-	GPIO.setup(BLUE_PIN, GPIO.OUT)
-
-	#sets the servo signal pin as an output
-	GPIO.setup(SERVO1_PIN, GPIO.OUT)
-	GPIO.setup(SERVO2_PIN, GPIO.OUT)
-	GPIO.setup(SERVO3_PIN, GPIO.OUT)
-	GPIO.setup(SERVO4_PIN, GPIO.OUT)
-	GPIO.setup(SERVO5_PIN, GPIO.OUT)
-	GPIO.setup(SERVO6_PIN, GPIO.OUT)
-
-	#sets LED PWM cycles at 50Hz starting at 0% duty cycle
-	redpwm = GPIO.PWM(RED_PIN, 50)
-	redpwm.start(0)
-
-	greenpwm = GPIO.PWM(GREEN_PIN, 50)
-	greenpwm.start(0)
-
-	bluepwm = GPIO.PWM(BLUE_PIN, 50)
-	bluepwm.start(0)
-
-	#sets all servo PWMS to 50Hz starting at 0% duty cycle
-	servo1 = GPIO.PWM(SERVO1_PIN, 50)
-	servo1.start(0)
+#sets up the bot with all of its commands, auto responses and endpoints
+#without connecting to discord or touching the hardware; anything left as
+#None comes from the config
+async def build_bot(hw=None, transports=None, reply_scheduler=None, quote_source=None,
+		startup=None, wire_format=None):
+	if startup is None:
+		startup = metrics.PhaseTimer()
 
-	servo2 = GPIO.PWM(SERVO2_PIN, 50)
-	servo2.start(0)
+	#every auto response trigger word compiled into a single matcher
+	trigger_matcher = triggers.default_matcher()
 
-	servo3 = GPIO.PWM(SERVO3_PIN, 50)
-	servo3.start(0)
+	#the real GPIO pins on the Pi, or a mock that records a trace of every
+	#duty cycle change (DUDEBOT_HARDWARE=mock)
+	if hw is None:
+		hw = hardware.get_backend()
 
-	servo4 = GPIO.PWM(SERVO4_PIN, 50)
-	servo4.start(0)
+	#sets LED PWM cycles at 50Hz starting at 0% duty cycle, the pins are
+	#opened by warm_up or on first use
+	redpwm = hw.pwm(hardware.RED_PIN)
+	greenpwm = hw.pwm(hardware.GREEN_PIN)
+	bluepwm = hw.pwm(hardware.BLUE_PIN)
 
-	servo5 = GPIO.PWM(SERVO5_PIN, 50)
-	servo5.start(0)
-
-	servo6 = GPIO.PWM(SERVO6_PIN, 50)
-	servo6.start(0)
+	#sets all servo PWMS to 50Hz starting at 0% duty cycle
+	servolist = [hw.pwm(pin) for pin in hardware.SERVO_PINS]
+	servo1 = servolist[0]
 
-	servolist = [servo1, servo2, servo3, servo4, servo5, servo6]
+	#captures come from the backend's camera, also opened by warm_up
+	camcontrol.capture_service.backend = hw.camera()
 
-	BIGDANCE_PATH = '/home/pi/dudebot/media/big-dance.gif'
-	MONKEYTYPE_PATH = '/home/pi/dudebot/media/monkey type.jpg'
+	#links to recent pictures, so an unchanged scene isn't uploaded twice
+	upload_cache = uploads.UploadCache()
 
 	intents = discord.Intents.all()
 	client = commands.Bot(command_prefix='.', intents=intents)
 
-	await client.add_cog(distributed.Node(client, callerid='dudebot'))
-
-	#uses the zenquotes api to receive a quote and the author
-	def get_quote():
-		response = requests.get("https://zenquotes.io/api/random")
-		json_data = json.loads(response.text)
-		quote = json_data[0]['q'] + " -" + json_data[0]['a']
-		return(quote)
+	#paces everything the bot says per channel and globally, command replies
+	#go first and auto responses get dropped when a channel floods
+	if reply_scheduler is None:
+		reply_scheduler = replies.ReplyScheduler()
+	client.reply_scheduler = reply_scheduler
+	client.startup = startup
+
+	#nodes on the same LAN can talk over TCP directly instead of through discord
+	if transports is None:
+		transports = []
+		direct_port = get_param("NODE_DIRECT_PORT", None)
+		if direct_port:
+			#every node on the LAN needs the same secret, only then can it call endpoints
+			secret = get_param("NODE_DIRECT_SECRET", None)
+			peers = [tuple(p.rsplit(':', 1)) for p in get_param("NODE_DIRECT_PEERS", [])]
+			if secret:
+				transports.append(DirectTransport(secret,
+					host=get_param("NODE_DIRECT_HOST", "127.0.0.1"), port=int(direct_port),
+					peers=[(host, int(port)) for host, port in peers]))
+			else:
+				print('NODE_DIRECT_SECRET is not set, direct transport disabled')
+
+	#set to json while nodes that only know the old format are still around
+	if wire_format is None:
+		wire_format = get_param("NODE_WIRE_FORMAT", "compact")
+	await client.add_cog(distributed.Node(client, callerid='dudebot', transports=transports,
+		wire_format=wire_format))
+
+	#keeps a buffer of quotes from the zenquotes api (or a local fixture) ready
+	if quote_source is None:
+		quote_source = quotes.make_source(get_param("QUOTE_SOURCE", quotes.ZENQUOTES_URL))
+	quote_provider = quotes.QuoteProvider(quote_source)
+	quote_provider.start()
+	client.quote_provider = quote_provider
 
 	#takes an array of ints and checks if input for RGB values are within compliance
 	def check_values(values):
@@ -178,6 +129,19 @@ async def main():
 		greenpwm.ChangeDutyCycle(greencol)
 		bluepwm.ChangeDutyCycle(bluecol)
 
+	#only one morse message can blink the LED at a time
+	led_lock = asyncio.Lock()
+
+	#blinks text as morse code on the RGB LED without blocking the bot
+	async def play_morse(text, color=(255, 255, 255)):
+		def set_state(on):
+			set_colors(list(color) if on else [0, 0, 0])
+
+		schedule = morse.compile_schedule(text)
+		async with led_lock, metrics.REGISTRY.timer('morse.play'):
+			await morse.play_schedule(schedule, set_state)
+		return morse.schedule_duration(schedule)
+
 	#generates a random color for the RGB LED if user doesn't specify values
 	def rand_rgb():
 		red = random.randint(0, 255)
@@ -193,11 +157,30 @@ async def main():
 	@client.event
 	async def on_ready():
 		print('Logged in as {0.user}'.format(client))
+		#only the first ready ends the phase, reconnects don't
+		if startup.end('connect'):
+			print(startup.report())
+
+	#times every command from invoke to finish, including failed ones
+	@client.before_invoke
+	async def start_command_timer(ctx):
+		ctx.metrics_start = time.perf_counter()
+
+	@client.after_invoke
+	async def stop_command_timer(ctx):
+		name = 'command.' + ctx.command.qualified_name
+		metrics.REGISTRY.observe(name, time.perf_counter() - ctx.metrics_start)
+		if ctx.command_failed:
+			metrics.REGISTRY.incr(name + '.errors')
 
 	#sends a quote from zenquotes	
 	@client.command(help="sends a quote from zenquotes")
 	async def wisdom(ctx):
-		quote = get_quote()
+		try:
+			quote = await quote_provider.get()
+		except asyncio.TimeoutError:
+			await ctx.send('The Dude is out of wisdom right now, try again later')
+			return
 		await ctx.send(quote)
 
 	#controls an RGB light using PWM signals
@@ -242,35 +225,66 @@ async def main():
 			await ctx.send('Please enter valid values')
 
 	#captures an image from the raspberry pi camera and sends it to discord
-	@client.command(help="captures an image from the raspberry pi camera")
-	async def picture(ctx):
-		#function taken from camcontrol
-		fp = get_image()
-		await ctx.send(file = discord.File(fp))
-
-	#verifies the angle input is valid and maps it to the correct duty cycle range
-	def angle_to_duty(angle):
-		if angle >= 0 and angle <= 180:
-			angle /= 180
-			angle *= 10
-			angle += 2
-			return angle
-		return None
-
-	#if the angle input is valid, set the duty cycle to the angle position
-	async def set_servo_angle_and_wait(servo, angle, wait_secs=0.1):
-		duty = angle_to_duty(angle)
-
-		if angle is None:
+	@client.command(help="captures an image from the raspberry pi camera, sized thumbnail, chat (default) or full")
+	async def picture(ctx, preset=camcontrol.DEFAULT_PRESET):
+		if preset not in camcontrol.PRESETS:
+			await ctx.send('Pick one of: ' + ', '.join(camcontrol.PRESETS))
 			return
 
-		servo.ChangeDutyCycle(duty)
-		print(duty)
+		#function taken from camcontrol, shares a capture with concurrent requests
+		image = await get_image(preset)
+
+		async def send():
+			message = await ctx.send(file = discord.File(io.BytesIO(image), filename='image.jpg'))
+			return message.attachments[0].url
+
+		#the exact same picture is linked from the last upload instead of sent
+		#again; never a merely similar one, .rgb needs the new LED colour to show
+		url, reused = await upload_cache.upload(image, send, group=preset)
+		if reused:
+			await ctx.send(url)
+
+	#keeps the camera capturing into a ring buffer so pictures come back instantly
+	@client.command(help="streams the camera into memory so pictures are instant, put in form on [fps] [frames kept] [preset] or off")
+	async def stream(ctx, state='', fps=camcontrol.STREAM_FRAMERATE, depth=camcontrol.STREAM_DEPTH,
+			preset=camcontrol.DEFAULT_PRESET):
+		if state == 'off':
+			await camcontrol.capture_service.stop_stream()
+			await ctx.send('Stopped streaming')
+			return
+		if state != 'on':
+			streaming = camcontrol.capture_service.streaming
+			await ctx.send('Streaming is ' + ('on' if streaming else 'off') + ', use on or off')
+			return
+
+		try:
+			await camcontrol.capture_service.start_stream(float(fps), int(depth), preset)
+		except ValueError as e:
+			await ctx.send(str(e))
+			return
+		await ctx.send('Streaming at ' + str(fps) + ' fps, keeping the last ' + str(depth) + ' frames')
+
+	#sends the most recent streamed frames, oldest first
+	@client.command(help="sends the last few streamed frames, up to 10")
+	async def burst(ctx, n='5'):
+		try:
+			frames = camcontrol.capture_service.burst(max(1, min(MAX_BURST, int(n))))
+		except ValueError as e:
+			await ctx.send(str(e))
+			return
+		if not frames:
+			await ctx.send('No frames yet, try again in a moment')
+			return
+
+		await ctx.send(files=[discord.File(io.BytesIO(frame), filename=f'frame{i}.jpg')
+			for i, frame in enumerate(frames)])
 
-		#allows the servo to move to the position
-		await asyncio.sleep(wait_secs)
+	#the arm moves all servos of a pose at once, each servo behind its own lock
+	arm_motion = motion.MotionExecutor(servolist)
 
-		servo.ChangeDutyCycle(SERVO_DO_NOTHING_DUTY) # do nothing
+	#named arm moves, compiled into duty cycle timelines by warm_up so they
+	#start instantly when called
+	macro_library = macros.MacroLibrary()
 
 	#turns servo on predetermined route
 	async def turn_servo(ctx):
@@ -301,10 +315,10 @@ async def main():
 		for angle in range(90, 180, step_size):
 			#rapidly sending messages aka angle readings stalls the program via discord timeouts lol
 			#await ctx.send(f"{angle} degrees.")
-			await set_servo_angle_and_wait(servo1, angle)
+			await arm_motion.move_servo(1, angle)
 			await asyncio.sleep(0.1)
 
-		await set_servo_angle_and_wait(servo1, 90, 1)
+		await arm_motion.move_servo(1, 90, 1)
 
 	#the actual discord command to move the servo
 	@client.command(help="moves an attached servo over a predefined range of angles")
@@ -324,48 +338,56 @@ async def main():
 			elif arg[0] == "on":
 				await ctx.send('Temporarily unavailable')
 			elif arg[0] == "off":
-				for num in range(6):
-					servolist[num].ChangeDutyCycle(SERVO_DO_NOTHING_DUTY)
+				arm_motion.stop()
 				await ctx.send('Arm status: off')
 			return
 
-		#continues if the input is even, or there are adequate servo and angle pairs
-		if len(arg) % 2 == 1:
-			await ctx.send('Please enter the correct number of parameters')
+		#checks the whole pose against the arm constraints before anything moves
+		try:
+			pose = motion.parse_pose(arg)
+		except ValueError as e:
+			await ctx.send(str(e))
 			return
 
-		stack = iter(arg)
-
-		#iterates through input and checks that each command entered is 
-		#valid within given arm constraints for each servo
-		for num in range(int(len(arg) / 2)):
-			servo = int(next(stack))
-			pos = int(next(stack))
-
-			#servo input must be for 1 of 6 arm servos
-			if servo < 1 or servo > 6:
-				await ctx.send('Please enter a valid servo')
-				return
-			
-			#angle for each servo must be within the 180 degree limit
-			if pos < 0 or pos > 180:
-				await ctx.send('Please enter a valid angle')
-				return
+		#drives every servo in the pose at once and reports back in one message
+		await arm_motion.move(pose, 1)
+		await ctx.send('Set ' + ', '.join('servo ' + str(servo) + ' to angle ' + str(pos)
+			for servo, pos in pose.items()))
 
-			#the end effector servo only has a range between 90 (open) and 180 (closed)
-			if servo == 1 and (pos < 90 or pos > 180):
-				await ctx.send('End effector (servo 1) angle must be between 90 and 180 degrees')
-				return
+	#plays one of the precompiled arm macros
+	@client.command(help="plays a named arm macro, leave blank to list them")
+	async def macro(ctx, name=None):
+		if name not in macro_library.macros:
+			await ctx.send('Available macros: ' + ', '.join(macro_library.names()))
+			return
 
-			#assigns the angle position to each servo and prints to discord
-			await set_servo_angle_and_wait(servolist[servo - 1], pos, 1)
-			await ctx.send('Setting servo ' + str(servo) + ' to angle ' + str(pos))
+		await ctx.send('Playing macro ' + name)
+		await macros.play(await macro_library.fetch(name), arm_motion)
+		await ctx.send('Done')
 
 	#returns the input message, used mostly for testing	
 	@client.command(help="returns the input message, used mostly for testing")
 	async def hello(ctx, *arg):
 		await ctx.send(arg)
 
+	#blinks a message in morse code on the RGB LED
+	@client.command(name="morse", help="blinks a message in morse code on the RGB LED")
+	async def morsecode(ctx, *words):
+		text = ' '.join(words)
+		if not text:
+			await ctx.send('Please enter a message')
+			return
+
+		await ctx.send('Blinking ' + morse.codec.encode(text))
+		await play_morse(text)
+		await ctx.send('Done')
+
+	#sends command and endpoint latencies, optionally only those starting with prefix
+	@client.command(help="shows latency and throughput stats, optionally filtered by a prefix")
+	async def stats(ctx, prefix=''):
+		report = metrics.REGISTRY.report(prefix)
+		await ctx.send('```\n' + report[:1900] + '\n```')
+
 	#sends the github url for source code
 	@client.command(help="sends the github url for source code")
 	async def source(ctx):
@@ -377,56 +399,67 @@ async def main():
 		#does nothing if the bot is the message sender
 		if message.author == client.user:
 			return
+		metrics.REGISTRY.incr('messages.received')
 		
 		#converts text to lowercase for easier text processing
 		message_lower = message.content.lower()
 
+		#finds every trigger category in the message in one pass
+		hits = trigger_matcher.match(message_lower)
+
+		#every auto response to this message goes out together as one message
+		batch = replies.ReplyBatch(message)
+
 		#sends dude if dude is in message
-		if "dude" in message_lower and random.random() < 0.1:
-			await message.channel.send("Dude...")
+		if "dude" in hits and random.random() < 0.1:
+			batch.add("Dude...")
 
 		#sends thinking emoji if someone is thinking
-		if "mmm" in message_lower:
+		if "thinking" in hits:
 			chance = random.random()
 			if chance < 0.1:
-				await message.channel.send('https://tenor.com/view/hmm-emoji-thinking-emoji-let-me-think-gif-16435497')
+				batch.add('https://tenor.com/view/hmm-emoji-thinking-emoji-let-me-think-gif-16435497')
 			elif chance >= 0.1 and chance < 0.2:
-				await message.channel.send('https://tenor.com/view/emoji-thinking-emoji-think-confused-hmm-gif-15742715')
+				batch.add('https://tenor.com/view/emoji-thinking-emoji-think-confused-hmm-gif-15742715')
 			elif chance >= 0.2 and chance < 0.3:
-				await message.channel.send('https://tenor.com/view/meme-thinking-gif-23334820')
+				batch.add('https://tenor.com/view/meme-thinking-gif-23334820')
 
 		#sends the famous The Dude quote if a word from opinions array is found
-		if any(word in message_lower for word in opinions):
+		if "opinion" in hits:
 			if random.random() < 0.1:
-				await message.channel.send("that's just, like, your opinion, man")
+				batch.add("that's just, like, your opinion, man")
 
 		#sends the dancing big man if someone uses a word from big array
-		if any(word in message_lower for word in big) and random.random() < 0.15:
-			await message.reply('https://tenor.com/view/big-dance-party-rock-funny-haha-poop-gif-18703825')
+		if "big" in hits and random.random() < 0.15:
+			batch.add('https://tenor.com/view/big-dance-party-rock-funny-haha-poop-gif-18703825', reply=True)
 
 		#deploy the monkey when the dude deems it necessary
 		if random.random() < 0.001:
-			await message.reply(file = discord.File(MONKEYTYPE_PATH))
+			batch.add(file = discord.File(MONKEYTYPE_PATH), reply=True)
 
-		if "morb" in message_lower and random.random() < 0.5:
-			await message.channel.send('Stop it, get help')
+		if "morb" in hits and random.random() < 0.5:
+			batch.add('Stop it, get help')
 
-		if "test" in message_lower and random.random() < 0.15:
-			await message.channel.send('Testes deez nuts')
+		if "test" in hits and random.random() < 0.15:
+			batch.add('Testes deez nuts')
 
 		#non-ascii quote delimiter used? fuck you (maybe)
-		if "’" in message_lower:
+		if "quote" in hits:
 			chance = random.random()
 			if chance < 0.01:
-				await message.channel.send('Fuck off')
+				batch.add('Fuck off')
 			elif chance >= 0.01 and chance <= 0.075:
-				await message.channel.send(':(')
+				batch.add(':(')
 			elif chance >= 0.075 and chance < 0.15:
-				await message.channel.send('Why do you do this to me?')
+				batch.add('Why do you do this to me?')
+			reply_scheduler.submit(batch)
 			return
 
+		#rate limited and dropped under load, never ahead of command replies
+		reply_scheduler.submit(batch)
+
 		#on_message overrides commands, so this is needed for commands to work
-		await client.process_commands(message)
+		await replies.process_commands(client, message)
 
 	async def arm_endpoint(node, **kwargs):
 		"""
@@ -437,20 +470,99 @@ async def main():
 		await turn_servo_two(step_size)
 		return dict(result='ok')
 
+	async def macro_endpoint(node, **kwargs):
+		"""
+		args: name
+		returns: plays a named arm macro
+		"""
+		timeline = await macro_library.fetch(kwargs['name'])
+		await macros.play(timeline, arm_motion)
+		return dict(result='ok', duration=timeline.duration)
+
+	async def morse_endpoint(node, **kwargs):
+		"""
+		args: text
+		returns: blinks the text in morse code on the RGB LED
+		"""
+		secs = await play_morse(kwargs['text'])
+		return dict(result='ok', duration=secs)
+
 	async def camera_endpoint(node, **kwargs):
 		"""
-		args: none
+		args: preset (optional, thumbnail, chat or full), similar (optional, 1 links
+		a near identical picture from the last few secs instead of uploading)
 		returns: my balls in pic form
 		"""
-		fp = get_image()
-		url = await node.send_file(fp)
-		return dict(result='ok', url=url)
-
-	distributed.register_endpoint(client, '/arm', arm_endpoint)
+		preset = kwargs.get('preset', camcontrol.DEFAULT_PRESET)
+		image = await get_image(preset)
+		url, reused = await upload_cache.upload(image,
+			lambda: node.send_file(io.BytesIO(image), filename='image.jpg'), group=preset,
+			near=bool(int(kwargs.get('similar', 0))))
+		return dict(result='ok', url=url, reused=reused)
+
+	async def burst_endpoint(node, **kwargs):
+		"""
+		args: n (optional, up to 10)
+		returns: links to the last n streamed frames, oldest first
+		"""
+		n = max(1, min(MAX_BURST, int(kwargs.get('n', 5))))
+		frames = camcontrol.capture_service.burst(n)
+		#one message for every frame, so a burst costs a single send
+		urls = await node.send_files([(io.BytesIO(frame), f'frame{i}.jpg')
+			for i, frame in enumerate(frames)]) if frames else []
+		return dict(result='ok', urls=urls)
+
+	#only one sweep can drive the arm at a time, later calls queue behind it
+	distributed.register_endpoint(client, '/arm', arm_endpoint, concurrency=1)
+	distributed.register_endpoint(client, '/macro', macro_endpoint, concurrency=1)
+	distributed.register_endpoint(client, '/morse', morse_endpoint, concurrency=1)
 	distributed.register_endpoint(client, '/camera', camera_endpoint)
+	distributed.register_endpoint(client, '/burst', burst_endpoint)
+
+	#opens the pins and the camera and compiles the macros off the event loop
+	#while discord connects; anything used before then opens on first use.
+	#with stream_fps the camera starts streaming once it is open
+	async def warm_up(stream_fps=0):
+		loop = asyncio.get_running_loop()
+		steps = {
+			'hardware': loop.run_in_executor(None, hw.open_all),
+			'camera': camcontrol.capture_service.open(),
+			'macros': loop.run_in_executor(None, macro_library.preload),
+		}
+		results = await asyncio.gather(*(startup.run(name, step) for name, step in steps.items()),
+			return_exceptions=True)
+		for name, result in zip(steps, results):
+			if isinstance(result, Exception):
+				print(f'Failed to set up {name}: {result}')
+		if stream_fps:
+			try:
+				await camcontrol.capture_service.start_stream(stream_fps)
+			except ValueError as e:
+				print(f'Failed to start streaming: {e}')
+		print(startup.report())
+
+	client.warm_up = warm_up
+
+	return client
 
-	#runs with the specific key for dudebot
-	await client.start(get_param("DUDEBOT_TOKEN"))
+
+async def main():
+	print('Starting up DudeBot...')
+	startup = metrics.PhaseTimer(start=STARTED)
+	startup.begin('imports', at=STARTED)
+	startup.end('imports')
+
+	#discord and the node cog come up first, the hardware follows behind
+	with startup.phase('build'):
+		client = await build_bot(startup=startup)
+	warm_up = asyncio.create_task(client.warm_up(float(get_param("CAMERA_STREAM_FPS", 0))))
+
+	async with client:
+		#runs with the specific key for dudebot
+		with startup.phase('login'):
+			await client.login(get_param("DUDEBOT_TOKEN"))
+		startup.begin('connect')
+		await client.connect()
 	
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,214 @@
+#! /usr/bin/env python3
+import asyncio
+import os
+import threading
+import time
+import camcontrol
+
+#sets up pins for RGB LED light
+RED_PIN = 17
+GREEN_PIN = 27
+BLUE_PIN = 22
+
+#pin for arm servo signals
+#arm servos are numbered, 1 for manipulator to 6 for base
+SERVO_PINS = [14, 15, 18, 23, 24, 25]
+
+#LEDs and servos all run at 50Hz
+PWM_FREQUENCY = 50
+
+#which backend to use when none is asked for, "pi" or "mock"
+HARDWARE_ENV = "DUDEBOT_HARDWARE"
+
+
+#records every duty cycle change with a timestamp
+class TraceRecorder:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        # (secs since start, pin, duty, whether it reached the pin)
+        self.entries = []
+
+    def record(self, pin, duty, written):
+        self.entries.append((self.clock() - self.start, pin, duty, written))
+
+    def writes(self, pin=None):
+        return [e for e in self.entries if e[3] and (pin is None or e[1] == pin)]
+
+    def summary(self):
+        written = sum(1 for e in self.entries if e[3])
+        return {"calls": len(self.entries), "written": written,
+                "dropped": len(self.entries) - written}
+
+    def dump(self, fn):
+        with open(fn, "w") as file:
+            file.write("secs,pin,duty,written\n")
+            for t, pin, duty, written in self.entries:
+                file.write(f"{t:.6f},{pin},{duty},{int(written)}\n")
+
+
+#a PWM output on one pin, opened and started at 0% duty cycle on first use;
+#writes that repeat the current duty cycle are dropped before they reach
+#the backend
+class PWMChannel:
+    def __init__(self, open_pwm, pin, recorder=None):
+        self.open_pwm = open_pwm
+        self.pin = pin
+        self.recorder = recorder
+        self.pwm = None
+        self.duty = None
+        self.dropped = 0
+        #opened from a background thread at startup, or by whoever gets here first
+        self.lock = threading.Lock()
+
+    def open(self):
+        if self.pwm is None:
+            with self.lock:
+                if self.pwm is None:
+                    pwm = self.open_pwm()
+                    pwm.start(0)
+                    self.duty = 0
+                    self.pwm = pwm
+        return self.pwm
+
+    def ChangeDutyCycle(self, duty):
+        self.open()
+        written = duty != self.duty
+        if self.recorder:
+            self.recorder.record(self.pin, duty, written)
+        if not written:
+            self.dropped += 1
+            return
+        self.pwm.ChangeDutyCycle(duty)
+        self.duty = duty
+
+    def stop(self):
+        if self.pwm is not None:
+            self.pwm.stop()
+        self.duty = None
+
+
+#nothing touches the pins until a channel is first used or open_all() runs
+class PiBackend:
+    name = "pi"
+
+    def __init__(self):
+        self.GPIO = None
+        self.lock = threading.Lock()
+        self.channels = []
+
+    def gpio(self):
+        with self.lock:
+            if self.GPIO is None:
+                import RPi.GPIO as GPIO
+
+                #uses broadcom pin names instead of board names
+                GPIO.setmode(GPIO.BCM)
+
+                #turns off warnings and clears all previous GPIO states
+                GPIO.setwarnings(False)
+                GPIO.cleanup()
+                self.GPIO = GPIO
+        return self.GPIO
+
+    #sets the pin as an output
+    def _open_pwm(self, pin, frequency):
+        GPIO = self.gpio()
+        GPIO.setup(pin, GPIO.OUT)
+        return GPIO.PWM(pin, frequency)
+
+    def pwm(self, pin, frequency=PWM_FREQUENCY):
+        channel = PWMChannel(lambda: self._open_pwm(pin, frequency), pin)
+        self.channels.append(channel)
+        return channel
+
+    #opens every channel handed out so far, meant to run off the event loop
+    def open_all(self):
+        for channel in self.channels:
+            channel.open()
+
+    def camera(self):
+        return camcontrol.PiCameraBackend()
+
+    def cleanup(self):
+        if self.GPIO is not None:
+            self.GPIO.cleanup()
+
+
+class MockPWM:
+    def __init__(self, pin, frequency):
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = None
+
+    def start(self, duty):
+        self.duty = duty
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+
+    def stop(self):
+        self.duty = None
+
+
+#runs anywhere, every duty cycle change ends up in self.trace
+class MockBackend:
+    name = "mock"
+
+    def __init__(self, camera_delay=0.3):
+        self.trace = TraceRecorder()
+        self.camera_delay = camera_delay
+        self.channels = []
+
+    def pwm(self, pin, frequency=PWM_FREQUENCY):
+        channel = PWMChannel(lambda: MockPWM(pin, frequency), pin, self.trace)
+        self.channels.append(channel)
+        return channel
+
+    def open_all(self):
+        for channel in self.channels:
+            channel.open()
+
+    def camera(self):
+        return camcontrol.FakeCamera(delay=self.camera_delay)
+
+    def cleanup(self):
+        pass
+
+
+BACKENDS = {
+    PiBackend.name: PiBackend,
+    MockBackend.name: MockBackend,
+}
+
+
+def get_backend(name=None):
+    name = name or os.environ.get(HARDWARE_ENV, PiBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown hardware backend {name}")
+    return BACKENDS[name]()
+
+
+#times a full arm pose on the mock backend
+async def _demo():
+    import motion
+    hw = MockBackend()
+    servos = [hw.pwm(pin) for pin in SERVO_PINS]
+    arm = motion.MotionExecutor(servos)
+    start = time.perf_counter()
+    await arm.move({1: 90, 2: 45, 3: 30, 4: 120, 5: 60, 6: 180}, 0.5)
+    await arm.move({1: 90, 2: 45, 3: 30, 4: 120, 5: 60, 6: 180}, 0.5)
+    print(f"two poses in {time.perf_counter() - start:.3f}s")
+    #every servo already holds at 0, so none of these reach the pins
+    arm.stop()
+    for t, pin, duty, written in hw.trace.entries:
+        print(f"{t:8.4f}s pin {pin:2} duty {duty:6.3f} {'' if written else '(dropped)'}")
+    print(hw.trace.summary())
+
+
+def main():
+    asyncio.run(_demo())
+
+
+if __name__ == "__main__":
+    main()
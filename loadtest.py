@@ -0,0 +1,367 @@
+#! /usr/bin/env python3
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import discord
+from discord.ext import commands
+import distributed
+import dudebot
+import hardware
+import quotes
+import replies
+from ratelimit import TokenBucket
+from transport import LoopbackHub, LoopbackTransport
+
+#replays fake chat and packet traffic through the real handlers without
+#discord, the Pi or the network, so it runs on any linux box:
+#
+#   python3 loadtest.py --messages 5000 --calls 2000 --peers 4
+
+#ordinary chat with the trigger words sprinkled in at roughly their usual rate
+CHAT_LINES = [
+    "anyone up for lunch",
+    "dude where did you park",
+    "mmm not sure about that",
+    "honestly I think the new build is worse",
+    "that file is massive",
+    "morbius was on tv again",
+    "can you test the arm before the demo",
+    "he said ’it works on my machine’",
+    "pushing the fix now",
+    "the servo is making that noise again",
+    "brb",
+    "what time is the meeting tomorrow",
+]
+
+#commands that finish quickly, so the numbers are about the handlers and
+#not about servos or morse playback
+COMMAND_LINES = [
+    ".hello there",
+    ".source",
+    ".wisdom",
+    ".rgb 10 20 30",
+    ".stats command",
+    ".macro",
+]
+
+COMMAND_SHARE = 0.1
+
+TEST_QUOTES = [
+    "The Dude abides. - The Dude",
+    "Careful, man, there's a beverage here! - The Dude",
+    "Yeah, well, you know, that's just, like, your opinion, man. - The Dude",
+]
+
+UNLIMITED_RATE = 1e9
+
+
+class FakeUser:
+    def __init__(self, id, name, bot=False):
+        self.id = id
+        self.name = name
+        self.bot = bot
+        self.mention = f"<@{id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeAttachment:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeMessage:
+    _state = None
+
+    def __init__(self, id, content, author, channel):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = None
+        self.attachments = []
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeChannel:
+    """
+    Counts what is sent instead of sending it, and hands every message sent
+    to it to its listeners, like the comms channel does for every node.
+    """
+
+    def __init__(self, id, name, author):
+        self.id = id
+        self.name = name
+        self.author = author
+        self.listeners = []
+        self.tasks = set()
+        self.last_id = 0
+        self.messages = 0
+        self.files = 0
+
+    def __str__(self):
+        return self.name
+
+    def message(self, content, author=None):
+        self.last_id += 1
+        return FakeMessage(self.last_id, content, author or self.author, self)
+
+    async def send(self, content=None, file=None, files=None, **kwargs):
+        self.messages += 1
+        m = self.message("" if content is None else str(content))
+        for f in ([file] if file else []) + list(files or []):
+            self.files += 1
+            m.attachments.append(FakeAttachment(f"https://cdn.invalid/{self.id}/{m.id}/{f.filename}"))
+            f.close()
+        for listener in self.listeners:
+            task = asyncio.create_task(listener(m))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return m
+
+    async def drain(self):
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks))
+
+
+#command replies normally go out through discord's HTTP api, here they go
+#straight to the fake channel
+async def _context_send(ctx, content=None, **kwargs):
+    return await ctx.channel.send(content, **kwargs)
+
+
+#swaps in the fake send and hides the per packet logging while running
+@contextlib.contextmanager
+def offline():
+    original = commands.Context.send
+    commands.Context.send = _context_send
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        commands.Context.send = original
+
+
+def unlimited_scheduler():
+    return replies.ReplyScheduler(
+        channel_rate=UNLIMITED_RATE, channel_burst=UNLIMITED_RATE,
+        global_rate=UNLIMITED_RATE, global_burst=UNLIMITED_RATE)
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Result:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.secs = 0.0
+        self.latencies = []
+        self.growth = 0
+        self.extra = ""
+
+    def __str__(self):
+        ordered = sorted(self.latencies)
+        rate = self.count / self.secs if self.secs else 0.0
+        per_k = self.growth / max(1, self.count) * 1000 / 1024
+        line = (f"{self.name:<18} {self.count:>6} {self.unit:<5} {rate:>9.1f}/s  "
+                f"p50 {percentile(ordered, 0.5) * 1000:7.2f}ms  "
+                f"p99 {percentile(ordered, 0.99) * 1000:7.2f}ms  "
+                f"mem {self.growth / 1024:+8.1f}KiB ({per_k:+.2f}KiB/1k)")
+        return line + ("  " + self.extra if self.extra else "")
+
+
+#runs jobs with at most concurrency of them in flight, timing each one
+async def run_jobs(jobs, concurrency, latencies):
+    jobs = iter(jobs)
+
+    async def worker():
+        for job in jobs:
+            start = time.perf_counter()
+            await job()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+#one warm up round, one timed round and one round under tracemalloc, so
+#the timing isn't skewed by the tracing
+async def measure(result, make_round):
+    await make_round([])
+    gc.collect()
+
+    start = time.perf_counter()
+    result.count = await make_round(result.latencies)
+    result.secs = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        await make_round([])
+        gc.collect()
+        result.growth = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+async def chat_benchmark(args, quote_path):
+    bot_user = FakeUser(1, "dudebot", bot=True)
+    users = [FakeUser(100 + i, f"user{i}") for i in range(20)]
+    channel = FakeChannel(10, "general", bot_user)
+    rng = random.Random(args.seed)
+
+    scheduler = replies.ReplyScheduler() if args.real_limits else unlimited_scheduler()
+    with offline():
+        client = await dudebot.build_bot(
+            hw=hardware.MockBackend(camera_delay=0), transports=[],
+            reply_scheduler=scheduler, quote_source=quotes.FileQuoteSource(quote_path),
+            wire_format="compact")
+        client._connection.user = bot_user
+        #the hardware and macros come up in the background, don't count that as growth
+        await client.warm_up()
+
+        async def send(content, author):
+            await client.on_message(channel.message(content, author))
+
+        async def one_round(latencies):
+            jobs = []
+            for _ in range(args.messages):
+                lines = COMMAND_LINES if rng.random() < COMMAND_SHARE else CHAT_LINES
+                content, author = rng.choice(lines), rng.choice(users)
+                jobs.append(lambda c=content, a=author: send(c, a))
+            await run_jobs(jobs, args.concurrency, latencies)
+            #auto responses go out in the background, wait for them too
+            while scheduler.tasks:
+                await asyncio.gather(*list(scheduler.tasks))
+            await channel.drain()
+            return args.messages
+
+        async with client:
+            result = await measure(Result("chat", "msgs"), one_round)
+        await client.quote_provider.stop()
+    result.extra = (f"replies {scheduler.sent} merged {scheduler.merged} "
+                    f"dropped {scheduler.dropped} sent {channel.messages}")
+    return result
+
+
+def make_nodes(bot, count):
+    return [distributed.Node(bot, callerid=f"node{i}") for i in range(count)]
+
+
+def attach_discord(nodes):
+    channel = FakeChannel(20, "node-comms", FakeUser(2, "node"))
+    for node in nodes:
+        node.attach_comms_channel(channel)
+        node.discord_transport.send_queue.bucket = TokenBucket(UNLIMITED_RATE, UNLIMITED_RATE)
+        channel.listeners.append(node.on_message)
+    return channel
+
+
+def attach_loopback(nodes):
+    hub = LoopbackHub()
+    for node in nodes:
+        node.add_transport(LoopbackTransport(hub))
+    return hub
+
+
+async def packet_benchmark(args, transport):
+    bot = commands.Bot(command_prefix=".", intents=discord.Intents.none())
+    rng = random.Random(args.seed)
+
+    with offline():
+        nodes = make_nodes(bot, args.peers)
+        channel = attach_discord(nodes) if transport == "discord" else None
+        if transport == "loopback":
+            attach_loopback(nodes)
+        for node in nodes:
+            await node.start_transports()
+
+        timeouts = 0
+
+        async def call(node, dst, endpoint, n, **body):
+            nonlocal timeouts
+            #always goes out, otherwise this would mostly measure the response cache
+            responses = await node.call_endpoint(dst, endpoint, n, timeout=args.timeout,
+                                                 use_cache=False, **body)
+            if len(responses) < n:
+                timeouts += 1
+
+        async def one_round(latencies):
+            jobs = []
+            for _ in range(args.calls):
+                caller = rng.choice(nodes)
+                target = rng.choice(nodes).caller_id
+                kind = rng.random()
+                if kind < 0.5:
+                    jobs.append(lambda c=caller, t=target: call(c, t, "/ping", 1))
+                elif kind < 0.8:
+                    jobs.append(lambda c=caller, t=target: call(c, t, "/add", 1, x=1, y=2, z=3))
+                else:
+                    #fan out, every node answers
+                    jobs.append(lambda c=caller: call(c, distributed.EVERYONE_WILDCARD,
+                                                      "/ping", len(nodes)))
+            await run_jobs(jobs, args.concurrency, latencies)
+            if channel:
+                await channel.drain()
+            return args.calls
+
+        result = await measure(Result(f"packets/{transport}", "calls"), one_round)
+        received = sum(t.texts_received for node in nodes for t in node.transports)
+        buffered = sum(node.packet_buffer.stats()["packets"] for node in nodes)
+        for node in nodes:
+            for t in node.transports:
+                await t.close()
+
+    result.extra = f"texts {received} buffered {buffered} short {timeouts}"
+    return result
+
+
+async def run(args):
+    fd, quote_path = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, "w") as file:
+        file.write("\n".join(TEST_QUOTES))
+    try:
+        results = []
+        if args.messages:
+            results.append(await chat_benchmark(args, quote_path))
+        if args.calls:
+            for transport in args.transport:
+                results.append(await packet_benchmark(args, transport))
+    finally:
+        os.remove(quote_path)
+    for r in results:
+        print(r)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline load test for dudebot")
+    parser.add_argument("--messages", type=int, default=2000, help="chat messages per round")
+    parser.add_argument("--calls", type=int, default=1000, help="endpoint calls per round")
+    parser.add_argument("--peers", type=int, default=4, help="nodes taking part in packet storms")
+    parser.add_argument("--concurrency", type=int, default=32, help="jobs in flight at once")
+    parser.add_argument("--timeout", type=float, default=5.0, help="endpoint call timeout")
+    parser.add_argument("--transport", nargs="+", default=["loopback", "discord"],
+                        choices=["loopback", "discord"])
+    parser.add_argument("--real-limits", action="store_true",
+                        help="keep discord's rate limits on chat replies")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
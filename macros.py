@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from motion import angle_to_duty, SERVO_DO_NOTHING_DUTY
+from metrics import REGISTRY
+
+#duty cycles are updated once per PWM period at 50Hz
+MACRO_TICK_SECS = 0.02
+
+CACHE_DIR = "/home/pi/dudebot/macro_cache"
+
+#bump when the compiled format changes so old cache files are ignored
+CACHE_VERSION = 1
+
+#named arm moves as keyframes of (secs, {servo: angle}); each servo moves
+#smoothly between the keyframes that mention it and is left alone otherwise
+MACROS = {
+    "home": [
+        (0.0, {1: 90, 2: 90, 3: 90, 4: 90, 5: 90, 6: 90}),
+        (1.0, {1: 90, 2: 90, 3: 90, 4: 90, 5: 90, 6: 90}),
+    ],
+    "sweep": [
+        (0.0, {1: 90}),
+        (3.0, {1: 180}),
+        (4.0, {1: 90}),
+    ],
+    "wave": [
+        (0.0, {6: 90, 4: 90, 3: 60}),
+        (0.5, {4: 45}),
+        (1.0, {4: 135}),
+        (1.5, {4: 45}),
+        (2.0, {4: 135}),
+        (2.5, {4: 90, 3: 60}),
+    ],
+    "grab": [
+        (0.0, {1: 90, 2: 90, 3: 90}),
+        (1.0, {2: 45, 3: 120}),
+        (1.5, {1: 90}),
+        (2.0, {1: 180}),
+        (3.0, {2: 90, 3: 90}),
+    ],
+    "nod": [
+        (0.0, {5: 90}),
+        (0.3, {5: 60}),
+        (0.6, {5: 120}),
+        (0.9, {5: 60}),
+        (1.2, {5: 90}),
+    ],
+}
+
+
+#a macro compiled down to the duty cycle of every servo it uses at every
+#tick, nan where a servo isn't being driven yet
+class Timeline:
+    def __init__(self, name, ticks, duties, servos):
+        self.name = name
+        self.ticks = ticks
+        self.duties = duties
+        self.servos = servos
+
+    @property
+    def duration(self):
+        return float(self.ticks[-1]) if len(self.ticks) else 0.0
+
+
+def macro_key(keyframes, tick=MACRO_TICK_SECS):
+    blob = json.dumps([CACHE_VERSION, tick, keyframes], sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def compile_macro(name, keyframes, tick=MACRO_TICK_SECS):
+    import numpy as np
+
+    servos = sorted({s for _, pose in keyframes for s in pose})
+    end = max(t for t, _ in keyframes)
+    ticks = np.arange(0.0, end + tick / 2, tick)
+    duties = np.full((len(ticks), len(servos)), np.nan)
+
+    for col, servo in enumerate(servos):
+        frames = [(t, pose[servo]) for t, pose in keyframes if servo in pose]
+        times = np.array([t for t, _ in frames])
+        #duty is linear in angle, so interpolating duties is the same as
+        #interpolating angles and converting each sample
+        points = [angle_to_duty(angle) for _, angle in frames]
+        if None in points:
+            raise ValueError(f"Macro {name} has an out of range angle for servo {servo}")
+        active = (ticks >= times[0]) & (ticks <= times[-1])
+        duties[active, col] = np.interp(ticks[active], times, np.array(points, dtype=float))
+
+    return Timeline(name, ticks, duties, servos)
+
+
+#compiles macros once, keeping the results in memory and on disk
+class MacroLibrary:
+    def __init__(self, macros=MACROS, cache_dir=CACHE_DIR, tick=MACRO_TICK_SECS):
+        self.macros = macros
+        self.cache_dir = cache_dir
+        self.tick = tick
+        self.compiled = {}
+        #preload and fetch compile from worker threads
+        self.lock = threading.Lock()
+
+    def names(self):
+        return sorted(self.macros)
+
+    def _cache_path(self, name):
+        key = macro_key(self.macros[name], self.tick)
+        return os.path.join(self.cache_dir, f"{name}-{key}.npz")
+
+    def _load(self, name):
+        import numpy as np
+        path = self._cache_path(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return Timeline(name, data["ticks"], data["duties"], data["servos"].tolist())
+        except Exception as e:
+            print(f"Ignoring bad macro cache {path}: {e}")
+            return None
+
+    def _save(self, timeline):
+        import numpy as np
+        path = self._cache_path(timeline.name)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, ticks=timeline.ticks, duties=timeline.duties,
+                     servos=np.array(timeline.servos))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Failed to cache macro {timeline.name}: {e}")
+
+    def get(self, name):
+        if name not in self.macros:
+            raise KeyError(f"No macro named {name}")
+        with self.lock:
+            if name not in self.compiled:
+                timeline = self._load(name)
+                if timeline is None:
+                    timeline = compile_macro(name, self.macros[name], self.tick)
+                    self._save(timeline)
+                self.compiled[name] = timeline
+            return self.compiled[name]
+
+    #get() for the event loop, anything not compiled yet is loaded or
+    #compiled in an executor so numpy and the disk stay off the loop
+    async def fetch(self, name):
+        if name in self.compiled:
+            return self.compiled[name]
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, name)
+
+    def preload(self):
+        for name in self.names():
+            self.get(name)
+
+
+#plays a timeline against absolute deadlines from the start, so a late tick
+#doesn't push back every tick after it
+async def play(timeline, arm):
+    import numpy as np
+
+    #takes every joint the macro uses, in order so two macros can't deadlock
+    locks = [arm.locks[servo - 1] for servo in sorted(timeline.servos)]
+    for lock in locks:
+        await lock.acquire()
+    try:
+        with REGISTRY.timer("macro.play"):
+            pwms = [arm.servos[servo - 1] for servo in timeline.servos]
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            ticks = timeline.ticks
+            i = 0
+            while i < len(ticks):
+                delay = start + ticks[i] - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                #running late, skip straight to the newest sample that is due
+                elapsed = loop.time() - start
+                while i + 1 < len(ticks) and ticks[i + 1] <= elapsed:
+                    i += 1
+                for pwm, duty in zip(pwms, timeline.duties[i]):
+                    if not np.isnan(duty):
+                        pwm.ChangeDutyCycle(float(duty))
+                i += 1
+            for pwm in pwms:
+                pwm.ChangeDutyCycle(SERVO_DO_NOTHING_DUTY)
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+async def _demo(name):
+    import hardware
+    import motion
+    hw = hardware.MockBackend()
+    arm = motion.MotionExecutor([hw.pwm(pin) for pin in hardware.SERVO_PINS])
+    library = MacroLibrary(cache_dir=os.path.join(tempfile.gettempdir(), "dudebot_macros"))
+
+    start = time.perf_counter()
+    timeline = library.get(name)
+    print(f"{name} ready in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    start = time.perf_counter()
+    await play(timeline, arm)
+    took = time.perf_counter() - start
+    print(f"played {name} in {took:.3f}s, drift {took - timeline.duration:+.4f}s")
+    print(hw.trace.summary())
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else "wave"
+    asyncio.run(_demo(name))
+
+
+if __name__ == "__main__":
+    main()
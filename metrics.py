@@ -0,0 +1,168 @@
+import bisect
+import time
+
+
+#latency bucket upper bounds in seconds, anything slower lands in the last one
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+    0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+#fixed bucket histogram, cheap enough to update on every call
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    #upper bound of the bucket holding the q-th quantile
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                bound = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+#times whatever runs inside it, usable with both with and async with
+class Timer:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.registry.incr(self.name + ".errors")
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class Registry:
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, secs):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        h.observe(secs)
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def snapshot(self, prefix=""):
+        return {
+            "uptime": time.time() - self.started,
+            "counters": {k: v for k, v in sorted(self.counters.items()) if k.startswith(prefix)},
+            "latency": {k: h.summary() for k, h in sorted(self.histograms.items()) if k.startswith(prefix)},
+        }
+
+    def report(self, prefix=""):
+        snap = self.snapshot(prefix)
+        lines = [f"uptime {snap['uptime']:.0f}s"]
+        for name, s in snap["latency"].items():
+            lines.append(f"{name}: n={s['count']} p50={s['p50'] * 1000:.1f}ms "
+                         f"p99={s['p99'] * 1000:.1f}ms max={s['max'] * 1000:.1f}ms")
+        for name, n in snap["counters"].items():
+            lines.append(f"{name}: {n}")
+        return "\n".join(lines)
+
+
+#the one registry everything in the process records into
+REGISTRY = Registry()
+
+
+#how long each step of startup took and when it finished, both relative to
+#when the timer was made
+class PhaseTimer:
+    def __init__(self, registry=REGISTRY, prefix="startup", clock=time.perf_counter, start=None):
+        self.registry = registry
+        self.prefix = prefix
+        self.clock = clock
+        self.start = clock() if start is None else start
+        self.open = {}
+        # (name, secs, finished secs after start)
+        self.phases = []
+
+    def begin(self, name, at=None):
+        self.open[name] = self.clock() if at is None else at
+
+    def end(self, name):
+        started = self.open.pop(name, None)
+        if started is None:
+            return None
+        now = self.clock()
+        self.phases.append((name, now - started, now - self.start))
+        self.registry.observe(f"{self.prefix}.{name}", now - started)
+        return self.phases[-1]
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    #awaits aw as one phase, for steps that run alongside others
+    async def run(self, name, aw):
+        with self.phase(name):
+            return await aw
+
+    def line(self, name, secs, at):
+        return f"{self.prefix} {name:<10} {secs * 1000:8.1f}ms  (ready at {at:.2f}s)"
+
+    def report(self):
+        return "\n".join(self.line(*p) for p in self.phases)
+
+
+class _Phase:
+    __slots__ = ("timer", "name")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.begin(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.end(self.name)
+        return False
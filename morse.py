@@ -1,6 +1,8 @@
 #! /usr/bin/env python3
 
 
+import asyncio
+import functools
 import sys
 import time
 
@@ -18,7 +20,7 @@ MORSE_CODE_DICT = {
     '1':'.----', '2':'..---', '3':'...--',
     '4':'....-', '5':'.....', '6':'-....',
     '7':'--...', '8':'---..', '9':'----.',
-    '0':'-----', ', ':'--..--', '.':'.-.-.-',
+    '0':'-----', ',':'--..--', '.':'.-.-.-',
     '?':'..--..', '/':'-..-.', '-':'-....-',
     '(':'-.--.', ')':'-.--.-', ' ': '/'
 }
@@ -34,6 +36,128 @@ def to_morse(text):
     return "".join(chr_to_morse(c) for c in text.upper())
 
 
+#separates letters in codec output; words are separated by the code for ' '
+LETTER_SEPARATOR = ' '
+WORD_SEPARATOR = MORSE_CODE_DICT[' ']
+
+UNKNOWN_CHAR = '?'
+
+
+#str.translate table that encodes anything it hasn't seen as UNKNOWN_CHAR
+class _EncodeTable(dict):
+    def __missing__(self, key):
+        value = self[ord(UNKNOWN_CHAR)]
+        self[key] = value
+        return value
+
+
+class _TrieNode:
+    __slots__ = ('char', 'children')
+
+    def __init__(self):
+        self.char = None
+        self.children = {}
+
+
+class MorseDecoder:
+    """
+    Incremental decoder: feed it chunks of '.', '-', letter and word
+    separators and it yields characters as soon as they are certain.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.node = root
+        self.emitted = False
+        self.bad = False
+
+    def _finish_letter(self):
+        char = None
+        if self.node is not self.root and not self.emitted:
+            char = UNKNOWN_CHAR if self.bad or self.node.char is None else self.node.char
+        self.node = self.root
+        self.emitted = False
+        self.bad = False
+        return char
+
+    def feed(self, chunk):
+        for s in chunk:
+            if s == '.' or s == '-':
+                if self.bad or self.emitted:
+                    #symbols past the end of a complete code become their
+                    #own unknown letter, the code itself was already sent
+                    self.bad = True
+                    self.emitted = False
+                    continue
+                child = self.node.children.get(s)
+                if child is None:
+                    self.bad = True
+                    continue
+                self.node = child
+                #nothing longer starts with this code, no need to wait
+                if not child.children:
+                    self.emitted = True
+                    yield child.char
+            elif s == WORD_SEPARATOR:
+                char = self._finish_letter()
+                if char:
+                    yield char
+                yield ' '
+            elif s.isspace():
+                char = self._finish_letter()
+                if char:
+                    yield char
+
+    def close(self):
+        char = self._finish_letter()
+        return char or ''
+
+
+class MorseCodec:
+    """
+    Encodes with a precomputed translation table and decodes with a trie of
+    codes. Encoded letters are separated by spaces, words by ' / '.
+    """
+
+    def __init__(self, table=MORSE_CODE_DICT):
+        encode = _EncodeTable()
+        for c, code in table.items():
+            for k in {c, c.lower()}:
+                encode[ord(k)] = code + LETTER_SEPARATOR
+        self.encode_table = encode
+
+        self.root = _TrieNode()
+        self.codes = {}
+        for c, code in table.items():
+            if code == WORD_SEPARATOR:
+                continue
+            node = self.root
+            for s in code:
+                node = node.children.setdefault(s, _TrieNode())
+            node.char = c
+            self.codes[code] = c
+
+    def encode(self, text):
+        return text.translate(self.encode_table).rstrip(LETTER_SEPARATOR)
+
+    def decoder(self):
+        return MorseDecoder(self.root)
+
+    def decode(self, morse):
+        d = self.decoder()
+        return "".join(d.feed(morse)) + d.close()
+
+    #whole strings can skip the trie walk and look each code up directly
+    def decode_all(self, morse):
+        out = []
+        for word in morse.split(WORD_SEPARATOR):
+            out.append("".join(self.codes.get(code, UNKNOWN_CHAR) for code in word.split()))
+        return " ".join(out)
+
+
+codec = MorseCodec()
+
+
 TIME_SLOW = 0.5
 
 SHORT_PULSE_PERIOD_SECS     = 0.3 * TIME_SLOW
@@ -42,30 +166,124 @@ BTWN_WORD_PULSE_PERIOD_SECS = 2.0 * TIME_SLOW
 FRAME_WAIT_SECS             = 0.2 * TIME_SLOW
 
 
+#gap between letters, so letters in the schedule don't run into each other
+BTWN_LETTER_PULSE_PERIOD_SECS = 0.6 * TIME_SLOW
+
+COMPILED_SCHEDULE_CACHE_SIZE = 256
+
+
+#turns text into a tuple of (light on, seconds) pulses, once per distinct text
+@functools.lru_cache(maxsize=COMPILED_SCHEDULE_CACHE_SIZE)
+def compile_schedule(text):
+    pulses = []
+
+    def add(state, secs):
+        #back to back pulses in the same state are merged into one
+        if pulses and pulses[-1][0] == state:
+            pulses[-1] = (state, pulses[-1][1] + secs)
+        else:
+            pulses.append((state, secs))
+
+    for i, c in enumerate(text.upper()):
+        if c not in MORSE_CODE_DICT:
+            continue
+        if i and pulses:
+            add(False, BTWN_LETTER_PULSE_PERIOD_SECS)
+        for m in MORSE_CODE_DICT[c]:
+            if m == '.': # short
+                add(True, SHORT_PULSE_PERIOD_SECS)
+            elif m == '-': # long
+                add(True, LONG_PULSE_PERIOD_SECS)
+            elif m == '/': # very long
+                add(False, BTWN_WORD_PULSE_PERIOD_SECS)
+            add(False, FRAME_WAIT_SECS)
+
+    #trailing darkness is just waiting around
+    while pulses and not pulses[-1][0]:
+        pulses.pop()
+    return tuple(pulses)
+
+
+def schedule_duration(schedule):
+    return sum(secs for _, secs in schedule)
+
+
+#plays a schedule against absolute deadlines from the start, so timing
+#error doesn't build up over a long message
+async def play_schedule(schedule, set_state):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    try:
+        for state, secs in schedule:
+            set_state(state)
+            deadline += secs
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        set_state(False)
+
+
+#prints the morse played so far and the light, one symbol at a time
 def morse_simulate(text):
     morse = to_morse(text)
     print(morse)
-    running = ""
-    for m in morse:
-        running += m
-        state = m == '.' or m == '-'
-        char = '#' if state else '_'
+    symbol_secs = {'.': SHORT_PULSE_PERIOD_SECS, '-': LONG_PULSE_PERIOD_SECS,
+                   '/': BTWN_WORD_PULSE_PERIOD_SECS}
+    #the states carry the progress so show() can draw it
+    schedule = []
+    for i, m in enumerate(morse):
+        running = morse[:i + 1]
+        schedule.append(((running, m in '.-'), symbol_secs.get(m, 0)))
+        schedule.append(((running, False), FRAME_WAIT_SECS))
+
+    def show(state):
+        if not state:
+            return
+        running, on = state
+        char = '#' if on else '_'
         print(f"\033[2K\r{running} {char}", end="")
         sys.stdout.flush()
-        if m == '.': # short
-            time.sleep(SHORT_PULSE_PERIOD_SECS)
-        elif m == '-': # long
-            time.sleep(LONG_PULSE_PERIOD_SECS)
-        elif m == '/': # very long
-            time.sleep(BTWN_WORD_PULSE_PERIOD_SECS)
-        print(f"\033[2K\r{running} _", end="")
-        sys.stdout.flush()
-        time.sleep(FRAME_WAIT_SECS)
+
+    asyncio.run(play_schedule(schedule, show))
     print()
-            
+
+
+def benchmark(n_chars=1_000_000):
+    text = ("the quick brown fox jumps over the lazy dog, 1234567890. " * (n_chars // 57 + 1))[:n_chars]
+
+    start = time.perf_counter()
+    to_morse(text)
+    old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoded = codec.encode(text)
+    new = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = codec.decode_all(encoded)
+    bulk = time.perf_counter() - start
+
+    start = time.perf_counter()
+    d = codec.decoder()
+    streamed = []
+    for i in range(0, len(encoded), 4096):
+        streamed.extend(d.feed(encoded[i:i + 4096]))
+    streamed.append(d.close())
+    stream = time.perf_counter() - start
+
+    assert decoded == "".join(streamed) == text.upper()
+    mb = n_chars / 1e6
+    print(f"to_morse:         {mb / old:8.2f} M chars/s")
+    print(f"codec encode:     {mb / new:8.2f} M chars/s")
+    print(f"codec decode:     {mb / bulk:8.2f} M chars/s")
+    print(f"streaming decode: {mb / stream:8.2f} M chars/s")
 
 
 def main():
+    if sys.argv[1:] == ["--bench"]:
+        benchmark()
+        return
     text = " ".join(sys.argv[1:])
     morse_simulate(text)
 
@@ -0,0 +1,86 @@
+import asyncio
+from metrics import REGISTRY
+
+#arm servos are numbered, 1 for manipulator to 6 for base
+ARM_SERVO_COUNT = 6
+END_EFFECTOR_SERVO = 1
+
+#if the servo receives a duty cycle of 0, it holds position
+SERVO_DO_NOTHING_DUTY = 0
+
+
+#verifies the angle input is valid and maps it to the correct duty cycle range
+def angle_to_duty(angle):
+    if angle >= 0 and angle <= 180:
+        angle /= 180
+        angle *= 10
+        angle += 2
+        return angle
+    return None
+
+
+#turns a flat list of servo angle pairs into a pose, raising ValueError with
+#a message for the user if any pair breaks the arm constraints
+def parse_pose(args):
+    if len(args) % 2 == 1:
+        raise ValueError('Please enter the correct number of parameters')
+
+    pose = {}
+    stack = iter(args)
+    for _ in range(len(args) // 2):
+        try:
+            servo = int(next(stack))
+            pos = int(next(stack))
+        except ValueError:
+            raise ValueError('Please enter valid values')
+
+        #servo input must be for 1 of 6 arm servos
+        if servo < 1 or servo > ARM_SERVO_COUNT:
+            raise ValueError('Please enter a valid servo')
+
+        #angle for each servo must be within the 180 degree limit
+        if pos < 0 or pos > 180:
+            raise ValueError('Please enter a valid angle')
+
+        #the end effector servo only has a range between 90 (open) and 180 (closed)
+        if servo == END_EFFECTOR_SERVO and (pos < 90 or pos > 180):
+            raise ValueError('End effector (servo 1) angle must be between 90 and 180 degrees')
+
+        if servo in pose:
+            raise ValueError(f'Servo {servo} was given more than once')
+        pose[servo] = pos
+
+    return pose
+
+
+#drives several arm servos at once, one lock per servo so overlapping
+#commands queue up on a joint instead of fighting over it
+class MotionExecutor:
+    def __init__(self, servos):
+        self.servos = servos
+        self.locks = [asyncio.Lock() for _ in servos]
+
+    async def move_servo(self, servo, angle, wait_secs=0.1):
+        duty = angle_to_duty(angle)
+        if duty is None:
+            return
+
+        async with self.locks[servo - 1], REGISTRY.timer("servo.move"):
+            pwm = self.servos[servo - 1]
+            pwm.ChangeDutyCycle(duty)
+
+            #allows the servo to move to the position
+            await asyncio.sleep(wait_secs)
+
+            pwm.ChangeDutyCycle(SERVO_DO_NOTHING_DUTY) # do nothing
+
+    #moves every servo in the pose together, so a pose takes as long as its
+    #slowest joint rather than the sum of them
+    async def move(self, pose, wait_secs=1):
+        REGISTRY.incr("servo.poses")
+        await asyncio.gather(*(self.move_servo(servo, angle, wait_secs)
+            for servo, angle in pose.items()))
+
+    def stop(self):
+        for pwm in self.servos:
+            pwm.ChangeDutyCycle(SERVO_DO_NOTHING_DUTY)
@@ -0,0 +1,88 @@
+import asyncio
+import collections
+from ratelimit import TokenBucket
+import wire
+from metrics import REGISTRY
+
+
+LINGER_SECS = 0.05
+BATCH_SEPARATOR = "\n"
+
+
+class SendQueue:
+    """
+    Paces messages to a channel with a token bucket and packs texts queued
+    close together into one message, separated by newlines. Texts put with
+    batch=False always go out in a message of their own.
+    """
+
+    def __init__(self, send, bucket=None, max_chars=wire.MAX_MESSAGE_CHARS,
+                 linger=LINGER_SECS, batch=True, name="outbound"):
+        self.send_func = send
+        self.name = name
+        self.batch = batch
+        self.bucket = bucket or TokenBucket()
+        self.max_chars = max_chars
+        self.linger = linger
+        self.queue = collections.deque()
+        self.worker = None
+        self.texts_sent = 0
+        self.messages_sent = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, text, batch=True):
+        """
+        Queues a text, returning a future that resolves once it was sent.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.append((text, fut, batch))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+        return fut
+
+    async def send(self, text, batch=True):
+        await self.put(text, batch)
+
+    def _take_batch(self):
+        texts, futs = [], []
+        size = 0
+        while self.queue:
+            text, fut, batch = self.queue[0]
+            extra = len(text) + (len(BATCH_SEPARATOR) if texts else 0)
+            if texts and (size + extra > self.max_chars or not batch):
+                break
+            self.queue.popleft()
+            texts.append(text)
+            futs.append(fut)
+            size += extra
+            if not self.batch or not batch:
+                break
+        return texts, futs
+
+    async def _run(self):
+        while self.queue:
+            # give responses that are about to be queued a chance to share
+            if self.batch:
+                await asyncio.sleep(self.linger)
+            await self.bucket.acquire()
+            texts, futs = self._take_batch()
+            try:
+                with REGISTRY.timer(self.name + ".send"):
+                    await self.send_func(BATCH_SEPARATOR.join(texts))
+            except Exception as e:
+                for fut in futs:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.texts_sent += len(texts)
+            self.messages_sent += 1
+            REGISTRY.incr(self.name + ".texts", len(texts))
+            for fut in futs:
+                if not fut.done():
+                    fut.set_result(None)
+
+
+def split_batch(content):
+    return content.split(BATCH_SEPARATOR)
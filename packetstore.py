@@ -0,0 +1,94 @@
+import collections
+import time
+
+
+DEFAULT_MAX_AGE_SECS = 60.0
+DEFAULT_MAX_COUNT = 2000
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+class PacketStore:
+    """
+    Recently seen packets in arrival order, indexed by id and by backlink,
+    bounded by age, count and (approximate) memory.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE_SECS, max_count=DEFAULT_MAX_COUNT,
+                 max_bytes=DEFAULT_MAX_BYTES, clock=time.monotonic):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.clock = clock
+        # id -> (arrival time, packet, size); insertion order is arrival order
+        self.packets = collections.OrderedDict()
+        # backlink -> {id: None}, a dict used as an ordered set
+        self.by_backlink = {}
+        self.bytes = 0
+        self.evicted_age = 0
+        self.evicted_count = 0
+        self.evicted_bytes = 0
+
+    def __len__(self):
+        return len(self.packets)
+
+    def __contains__(self, pid):
+        return pid in self.packets
+
+    def add(self, packet, size):
+        """
+        Stores a packet, returning False if its id is already stored.
+        """
+        now = self.clock()
+        if packet.id in self.packets:
+            return False
+        self.packets[packet.id] = (now, packet, size)
+        self.bytes += size
+        if packet.backlink:
+            self.by_backlink.setdefault(packet.backlink, {})[packet.id] = None
+        self.evict(now)
+        return True
+
+    def get(self, pid):
+        entry = self.packets.get(pid)
+        return entry[1] if entry else None
+
+    def responses_to(self, pid):
+        ids = self.by_backlink.get(pid, ())
+        return [self.packets[i][1] for i in ids]
+
+    def _pop_oldest(self):
+        pid, (_, packet, size) = self.packets.popitem(last=False)
+        self.bytes -= size
+        if packet.backlink:
+            siblings = self.by_backlink[packet.backlink]
+            del siblings[pid]
+            if not siblings:
+                del self.by_backlink[packet.backlink]
+
+    def evict(self, now=None):
+        # every packet is popped at most once, so this is amortized O(1) per add
+        if now is None:
+            now = self.clock()
+        cutoff = now - self.max_age
+        while self.packets:
+            arrived = next(iter(self.packets.values()))[0]
+            if arrived < cutoff:
+                self.evicted_age += 1
+            elif len(self.packets) > self.max_count:
+                self.evicted_count += 1
+            elif self.bytes > self.max_bytes:
+                self.evicted_bytes += 1
+            else:
+                break
+            self._pop_oldest()
+
+    def stats(self):
+        self.evict()
+        return {
+            "packets": len(self.packets),
+            "bytes": self.bytes,
+            "backlinks": len(self.by_backlink),
+            "evicted_age": self.evicted_age,
+            "evicted_count": self.evicted_count,
+            "evicted_bytes": self.evicted_bytes,
+        }
@@ -0,0 +1,114 @@
+import hashlib
+import math
+import time
+
+
+HEARTBEAT_SECS = 30.0
+# a peer that missed this many heartbeats in a row is taken for dead
+MISSED_HEARTBEATS = 3
+PEER_TTL_SECS = HEARTBEAT_SECS * MISSED_HEARTBEATS + HEARTBEAT_SECS / 2
+
+
+class Peer:
+    def __init__(self, caller_id, last_seen):
+        self.caller_id = caller_id
+        self.instance = None
+        self.hostname = None
+        self.endpoints = set()
+        # endpoints it says can safely run twice
+        self.idempotent = set()
+        # calls running or queued on it when it last told us
+        self.load = 0
+        self.last_seen = last_seen
+
+    def update(self, info):
+        self.instance = info.get("instance")
+        self.hostname = info.get("hostname")
+        self.endpoints = set(info.get("endpoints", []))
+        self.idempotent = set(info.get("idempotent", []))
+        self.load = info.get("load", 0)
+
+
+# a stable number in (0, 1) for the pair, the same on every node
+def _unit_hash(key, caller_id):
+    digest = hashlib.blake2b(f"{key}:{caller_id}".encode(), digest_size=8).digest()
+    return (int.from_bytes(digest, "big") + 1) / (2 ** 64 + 2)
+
+
+def rendezvous_rank(key, candidates, load=lambda p: p.load):
+    """
+    Orders candidates for the request key by weighted rendezvous hashing,
+    best first. Every node with the same candidates and loads agrees on
+    the order, and a peer with load n gets picked 1 / (n + 1) as often as
+    an idle one.
+    """
+    def score(p):
+        weight = 1.0 / (1 + max(0, load(p)))
+        return -weight / math.log(_unit_hash(key, p.caller_id))
+    return sorted(candidates, key=score, reverse=True)
+
+
+class PeerRegistry:
+    """
+    Every node heard from recently, filled in from heartbeats and /ping
+    responses. Peers that stay quiet for longer than ttl are dropped.
+    """
+
+    def __init__(self, ttl=PEER_TTL_SECS, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.peers = {}
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.live())
+
+    def seen(self, caller_id, info=None):
+        """
+        Marks caller_id as alive, with its /ping info if there is some.
+        Returns True for a peer that wasn't known, or came back as a new
+        instance.
+        """
+        peer = self.peers.get(caller_id)
+        if peer is None:
+            # nothing to go on until it tells us what it serves
+            if info is None:
+                return False
+            peer = self.peers[caller_id] = Peer(caller_id, self.clock())
+            peer.update(info)
+            return True
+        peer.last_seen = self.clock()
+        if info is None:
+            return False
+        restarted = info.get("instance") != peer.instance
+        peer.update(info)
+        return restarted
+
+    def expire(self):
+        cutoff = self.clock() - self.ttl
+        dead = [k for k, p in self.peers.items() if p.last_seen < cutoff]
+        for k in dead:
+            del self.peers[k]
+        self.expired += len(dead)
+        return dead
+
+    def get(self, caller_id):
+        self.expire()
+        return self.peers.get(caller_id)
+
+    def live(self):
+        self.expire()
+        return list(self.peers.values())
+
+    def with_endpoint(self, endpoint):
+        return [p for p in self.live() if endpoint in p.endpoints]
+
+    def snapshot(self):
+        now = self.clock()
+        return {p.caller_id: {
+            "instance": p.instance,
+            "hostname": p.hostname,
+            "endpoints": sorted(p.endpoints),
+            "load": p.load,
+            "last_seen_secs": round(now - p.last_seen, 1),
+        } for p in self.live()}
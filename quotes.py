@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+import asyncio
+import json
+import random
+import sys
+import time
+import aiohttp
+
+
+#the batch endpoint hands back 50 quotes per request, which keeps us well
+#under the free tier limit compared to one request per quote
+ZENQUOTES_URL = "https://zenquotes.io/api/quotes"
+
+DEFAULT_BUFFER_SIZE = 50
+DEFAULT_WORKERS = 2
+MIN_BACKOFF_SECS = 2.0
+MAX_BACKOFF_SECS = 300.0
+
+
+class RateLimited(Exception):
+
+    def __init__(self, retry_after=None):
+        super().__init__(f"Rate limited, retry after {retry_after}")
+        self.retry_after = retry_after
+
+
+def format_quote(entry):
+    return entry['q'] + " -" + entry['a']
+
+
+class ZenQuotesSource:
+    """
+    Fetches batches of quotes from zenquotes, or anything that speaks the
+    same json format (e.g. a local stub server), over one pooled session.
+    """
+
+    def __init__(self, url=ZENQUOTES_URL, timeout=10, pool_size=DEFAULT_WORKERS):
+        self.url = url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def fetch(self):
+        session = self._get_session()
+        async with session.get(self.url) as response:
+            if response.status == 429:
+                retry_after = response.headers.get("Retry-After")
+                raise RateLimited(float(retry_after) if retry_after else None)
+            response.raise_for_status()
+            json_data = json.loads(await response.text())
+
+        #zenquotes answers a rate limited request with a 200 and a single
+        #quote explaining the limit, attributed to itself
+        if len(json_data) == 1 and json_data[0].get('a') == "zenquotes.io":
+            raise RateLimited()
+        return [format_quote(entry) for entry in json_data]
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class FileQuoteSource:
+    """
+    Serves quotes from a local fixture file, either a zenquotes style json
+    list or plain text with one quote per line.
+    """
+
+    def __init__(self, path, batch_size=10):
+        self.path = path
+        self.batch_size = batch_size
+        self.quotes = None
+
+    def _load(self):
+        with open(self.path, "r") as file:
+            text = file.read()
+        try:
+            return [format_quote(entry) for entry in json.loads(text)]
+        except ValueError:
+            return [l.strip() for l in text.split("\n") if l.strip()]
+
+    async def fetch(self):
+        if self.quotes is None:
+            self.quotes = self._load()
+        if not self.quotes:
+            return []
+        return random.choices(self.quotes, k=self.batch_size)
+
+    async def close(self):
+        pass
+
+
+def make_source(spec):
+    if spec.startswith("http://") or spec.startswith("https://"):
+        return ZenQuotesSource(spec)
+    return FileQuoteSource(spec)
+
+
+class QuoteProvider:
+    """
+    Keeps a bounded buffer of ready quotes topped up by background workers,
+    so a warm get() never waits on the network.
+    """
+
+    def __init__(self, source, buffer_size=DEFAULT_BUFFER_SIZE, workers=DEFAULT_WORKERS,
+                 min_backoff=MIN_BACKOFF_SECS, max_backoff=MAX_BACKOFF_SECS):
+        self.source = source
+        self.buffer = asyncio.Queue(maxsize=buffer_size)
+        #refilling starts once the buffer drains to half, so one request
+        #doesn't turn into one upstream fetch
+        self.low_water = buffer_size // 2
+        self.n_workers = workers
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.workers = []
+        self.space = asyncio.Event()
+        self.space.set()
+
+    def start(self):
+        if self.workers:
+            return
+        for _ in range(self.n_workers):
+            self.workers.append(asyncio.create_task(self._refill()))
+
+    async def stop(self):
+        for w in self.workers:
+            w.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        await self.source.close()
+
+    def _fail(self, retry_after=None):
+        self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+        wait = retry_after if retry_after is not None else self.backoff
+        self.retry_at = max(self.retry_at, time.monotonic() + wait)
+
+    async def _refill(self):
+        while True:
+            await self.space.wait()
+            delay = self.retry_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                batch = await self.source.fetch()
+            except asyncio.CancelledError:
+                raise
+            except RateLimited as e:
+                print(f"Quote source rate limited: {e}")
+                self._fail(e.retry_after)
+                continue
+            except Exception as e:
+                print(f"Failed to fetch quotes: {e}")
+                self._fail()
+                continue
+
+            if not batch:
+                self._fail()
+                continue
+
+            self.backoff = 0.0
+            for quote in batch:
+                if self.buffer.full():
+                    break
+                self.buffer.put_nowait(quote)
+            if self.buffer.qsize() > self.low_water:
+                self.space.clear()
+
+    async def get(self, timeout=10):
+        self.start()
+        try:
+            quote = self.buffer.get_nowait()
+        except asyncio.QueueEmpty:
+            quote = await asyncio.wait_for(self.buffer.get(), timeout)
+        if self.buffer.qsize() <= self.low_water:
+            self.space.set()
+        return quote
+
+
+async def _demo(spec, n):
+    provider = QuoteProvider(make_source(spec))
+    provider.start()
+    print(await provider.get())
+    start = time.perf_counter()
+    for _ in range(n):
+        await provider.get()
+    elapsed = time.perf_counter() - start
+    print(f"{n} warm quotes in {elapsed * 1e6 / n:.1f} us/quote")
+    await provider.stop()
+
+
+def main():
+    spec = sys.argv[1] if len(sys.argv) > 1 else ZENQUOTES_URL
+    asyncio.run(_demo(spec, 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+
+# discord lets a bot send about 5 messages per 5 seconds to one channel
+CHANNEL_RATE_PER_SEC = 1.0
+CHANNEL_BURST = 5
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to capacity tokens, refilled at rate
+    tokens per second.
+    """
+
+    def __init__(self, rate=CHANNEL_RATE_PER_SEC, capacity=CHANNEL_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, n=1, reserve=0):
+        """
+        Takes n tokens if that still leaves reserve tokens in the bucket.
+        """
+        self._refill()
+        if self.tokens - n < reserve:
+            return False
+        self.tokens -= n
+        return True
+
+    def delay(self, n=1):
+        self._refill()
+        missing = n - self.tokens
+        return max(0.0, missing / self.rate)
+
+    async def acquire(self, n=1):
+        while not self.try_acquire(n):
+            await asyncio.sleep(self.delay(n))
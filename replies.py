@@ -0,0 +1,130 @@
+import asyncio
+from discord.ext import commands
+from ratelimit import TokenBucket, CHANNEL_RATE_PER_SEC, CHANNEL_BURST
+import wire
+from metrics import REGISTRY
+
+
+#command replies always go out, auto responses only when there's room
+PRIORITY_COMMAND = 0
+PRIORITY_JOKE = 1
+
+#discord allows a bot roughly 50 requests a second across everything
+GLOBAL_RATE_PER_SEC = 40.0
+GLOBAL_BURST = 40
+
+#tokens in each bucket that auto responses leave for commands
+JOKE_RESERVE = 2
+
+#how long an auto response may wait for a token before it is dropped
+JOKE_MAX_DEFER_SECS = 2.0
+
+
+#all the auto responses one incoming message triggered, sent as one message
+class ReplyBatch:
+    def __init__(self, message):
+        self.message = message
+        self.lines = []
+        self.files = []
+        self.reply = False
+
+    def __bool__(self):
+        return bool(self.lines or self.files)
+
+    def add(self, content=None, file=None, reply=False):
+        if content:
+            self.lines.append(content)
+        if file:
+            self.files.append(file)
+        self.reply = self.reply or reply
+
+
+class ReplyScheduler:
+    def __init__(self, channel_rate=CHANNEL_RATE_PER_SEC, channel_burst=CHANNEL_BURST,
+                 global_rate=GLOBAL_RATE_PER_SEC, global_burst=GLOBAL_BURST,
+                 joke_reserve=JOKE_RESERVE, joke_max_defer=JOKE_MAX_DEFER_SECS):
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.channel_buckets = {}
+        self.joke_reserve = joke_reserve
+        self.joke_max_defer = joke_max_defer
+        self.tasks = set()
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+
+    def channel_bucket(self, channel):
+        if channel.id not in self.channel_buckets:
+            self.channel_buckets[channel.id] = TokenBucket(self.channel_rate, self.channel_burst)
+        return self.channel_buckets[channel.id]
+
+    def _try_both(self, bucket, reserve):
+        if not bucket.try_acquire(reserve=reserve):
+            return False
+        if not self.global_bucket.try_acquire(reserve=reserve):
+            bucket.tokens += 1 # give the channel token back
+            return False
+        return True
+
+    #waits for a token in the channel and global buckets; auto responses
+    #give up after a while instead of queueing behind a flood
+    async def acquire(self, channel, priority=PRIORITY_COMMAND):
+        bucket = self.channel_bucket(channel)
+        if priority == PRIORITY_COMMAND:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            return True
+
+        loop = asyncio.get_running_loop()
+        give_up = loop.time() + self.joke_max_defer
+        reserve = self.joke_reserve
+        while not self._try_both(bucket, reserve):
+            wait = max(bucket.delay(1 + reserve), self.global_bucket.delay(1 + reserve))
+            if loop.time() + wait > give_up:
+                return False
+            await asyncio.sleep(wait)
+        return True
+
+    async def send_batch(self, batch):
+        if not batch:
+            return None
+        message = batch.message
+        if not await self.acquire(message.channel, PRIORITY_JOKE):
+            self.dropped += 1
+            REGISTRY.incr("replies.dropped")
+            return None
+
+        self.sent += 1
+        self.merged += max(0, len(batch.lines) + len(batch.files) - 1)
+        REGISTRY.incr("replies.merged", max(0, len(batch.lines) + len(batch.files) - 1))
+        content = "\n".join(batch.lines)[:wire.MAX_MESSAGE_CHARS] or None
+        send = message.reply if batch.reply else message.channel.send
+        with REGISTRY.timer("replies.send"):
+            return await send(content, files=batch.files or None)
+
+    #sends the batch in the background so it never holds up commands
+    def submit(self, batch):
+        if not batch:
+            return
+        task = asyncio.create_task(self.send_batch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+#commands context whose replies take a token from the scheduler first
+class ScheduledContext(commands.Context):
+    async def send(self, *args, **kwargs):
+        scheduler = getattr(self.bot, "reply_scheduler", None)
+        if scheduler:
+            await scheduler.acquire(self.channel, PRIORITY_COMMAND)
+        with REGISTRY.timer("replies.command_send"):
+            return await super().send(*args, **kwargs)
+
+
+#same as Bot.process_commands, but with replies going through the scheduler
+async def process_commands(bot, message):
+    if message.author.bot:
+        return
+    ctx = await bot.get_context(message, cls=ScheduledContext)
+    await bot.invoke(ctx)
@@ -0,0 +1,77 @@
+import collections
+import json
+import time
+
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+# the same body always gives the same key, whatever order it was built in
+def body_key(body):
+    return json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ResponseCache:
+    """
+    An LRU of endpoint responses where every entry expires after its own
+    ttl, or never if it was stored without one.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        # key -> (expires at or None, value), least recently used first
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires is None or self.clock() < expires:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+            self.expired += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, value, ttl=None):
+        if ttl is not None and ttl <= 0:
+            return
+        expires = None if ttl is None else self.clock() + ttl
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def invalidate(self, match=None):
+        """
+        Drops every entry, or only those whose key match(key) is true for.
+        Returns how many were dropped.
+        """
+        if match is None:
+            n = len(self.entries)
+            self.entries.clear()
+            return n
+        stale = [k for k in self.entries if match(k)]
+        for k in stale:
+            del self.entries[k]
+        return len(stale)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
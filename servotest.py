@@ -1,22 +1,23 @@
 #! /usr/bin/env python3
-import RPi.GPIO as GPIO
+import hardware
 import time
 import asyncio
 
 #pin for servo signal
 SIGNAL = 23
 
-#uses broadcom pin names and disables warnings
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+servo = None
 
-#sets the servo signal pin as an output
-GPIO.setup(SIGNAL, GPIO.OUT)
-
-servo = GPIO.PWM(SIGNAL, 50)
-servo.start(0)
+#the Pi's GPIO, or the mock backend with DUDEBOT_HARDWARE=mock, set up on
+#first use so importing this doesn't touch the pins
+def get_servo():
+    global servo
+    if servo is None:
+        servo = hardware.get_backend().pwm(SIGNAL)
+    return servo
 
 async def turn_servo():
+    servo = get_servo()
     print("Waiting for 2 seconds")
     await asyncio.sleep(2)
 
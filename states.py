@@ -1,5 +1,8 @@
 import yaml
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
 
 YAML_PATH = "/home/pi/dudebot/dudebot_config.yaml"
 
@@ -11,32 +14,120 @@ class NoAliasDumper(yaml.Dumper):
 def load_yaml(fn):
     if not os.path.exists(fn):
         dump_yaml({}, fn)
-    file = open(fn, "r")
-    state = yaml.safe_load(file)
+    with open(fn, "r") as file:
+        state = yaml.safe_load(file)
     return state
 
-#writes to all yaml file params
+#writes to all yaml file params, through a temp file so a crash mid write
+#can never leave a half written config behind
 def dump_yaml(dict, fn):
-    file = open(fn, "w")
-    yaml.dump(dict, file, default_flow_style=False, Dumper=NoAliasDumper)
+    dirname = os.path.dirname(os.path.abspath(fn))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp-", suffix=".yaml")
+    try:
+        with os.fdopen(fd, "w") as file:
+            yaml.dump(dict, file, default_flow_style=False, Dumper=NoAliasDumper)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(fn):
+            os.chmod(tmp, os.stat(fn).st_mode & 0o777)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+#keeps the parsed params in memory, re-reading the file only when it changes
+class ConfigStore:
+    def __init__(self, fn):
+        self.fn = fn
+        self.state = None
+        self.stamp = None
+        self.batch_depth = 0
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.fn)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        stamp = self._stamp()
+        if self.state is not None and stamp == self.stamp:
+            return
+        #unsaved changes win over whatever is on disk
+        if self.dirty:
+            return
+        self.state = load_yaml(self.fn) or {}
+        self.stamp = self._stamp()
+
+    def get(self, name, default=None):
+        with self.lock:
+            self._refresh()
+            return self.state.get(name, default)
+
+    def __contains__(self, name):
+        with self.lock:
+            self._refresh()
+            return name in self.state
+
+    def set(self, name, value):
+        with self.lock:
+            self._refresh()
+            self.state[name] = value
+            self.dirty = True
+            if self.batch_depth == 0:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            dump_yaml(self.state, self.fn)
+            self.stamp = self._stamp()
+            self.dirty = False
+
+    #groups several sets into a single write
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self.flush()
+
+stores = {}
+stores_lock = threading.Lock()
+
+def get_store(fn=YAML_PATH):
+    with stores_lock:
+        if fn not in stores:
+            stores[fn] = ConfigStore(fn)
+        return stores[fn]
 
 #sets a particular key-value pair
 def set_param(name, value, fn=YAML_PATH):
-    state = load_yaml(fn)
-    if state is None:
-        state = {}
-    state[name] = value
-    dump_yaml(state, fn)
+    get_store(fn).set(name, value)
 
 #returns a particular key-value pair
 def get_param(name, default=None, fn=YAML_PATH):
-    state = load_yaml(fn)
-    if state and name in state:
-        return state[name]
+    store = get_store(fn)
+    if name in store:
+        return store.get(name)
     print(f"Failed to get parameter {name}, using default: {default}")
     set_param(name, default, fn)
     return default
 
+#groups every set_param (and get_param default) inside it into one write
+def batch(fn=YAML_PATH):
+    return get_store(fn).batch()
+
 
 def main():
     print("This is the main program!")
@@ -45,4 +136,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
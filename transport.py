@@ -0,0 +1,274 @@
+import asyncio
+import hashlib
+import hmac
+import secrets
+from outbound import SendQueue, split_batch
+
+
+# lower is faster; a packet for a peer goes over the fastest transport
+# that can reach it
+PRIORITY_LOOPBACK = 0
+PRIORITY_DIRECT = 10
+PRIORITY_DISCORD = 100
+
+# first line on a direct connection, a random challenge for the other side
+NONCE_PREFIX = "~nonce:"
+# the answer to it, telling the other side who we are
+HELLO_PREFIX = "~hello:"
+
+
+class Transport:
+    """
+    Carries packet texts between nodes. Received texts are handed to the
+    node through the receiver set by attach().
+    """
+
+    name = "transport"
+    priority = PRIORITY_DISCORD
+
+    def __init__(self):
+        self.node_id = None
+        self.receiver = None
+        self.texts_sent = 0
+        self.texts_received = 0
+
+    def attach(self, node_id, receiver):
+        self.node_id = node_id
+        self.receiver = receiver
+
+    def reaches(self, dst):
+        """
+        Whether a packet sent to dst on this transport will get there.
+        """
+        return False
+
+    async def start(self):
+        pass
+
+    # batch=False asks for the text to go out on its own where the
+    # transport would otherwise pack several together
+    async def send(self, text, dst=None, batch=True):
+        raise NotImplementedError()
+
+    async def deliver(self, text):
+        self.texts_received += 1
+        if self.receiver:
+            await self.receiver(text)
+
+    async def close(self):
+        pass
+
+
+class DiscordTransport(Transport):
+    """
+    The node comms channel. Every node reads it, so it reaches everyone.
+    """
+
+    name = "discord"
+    priority = PRIORITY_DISCORD
+
+    def __init__(self, channel, batch=True):
+        super().__init__()
+        self.channel = channel
+        self.send_queue = SendQueue(channel.send, batch=batch, name="outbound.discord")
+
+    def reaches(self, dst):
+        return True
+
+    async def send(self, text, dst=None, batch=True):
+        self.texts_sent += 1
+        await self.send_queue.put(text, batch)
+
+    async def deliver_message(self, content):
+        # one message can carry several packets, one per line
+        for text in split_batch(content):
+            await self.deliver(text)
+
+    async def send_file(self, file):
+        return (await self.send_files([file]))[0]
+
+    # up to 10 files in one message, for the price of one token
+    async def send_files(self, files):
+        await self.send_queue.bucket.acquire()
+        m = await self.channel.send(files=files)
+        return [a.url for a in m.attachments]
+
+
+class LoopbackHub:
+    """
+    An in-process stand in for the comms channel, shared by every
+    LoopbackTransport created with it.
+    """
+
+    def __init__(self):
+        self.members = []
+        self.tasks = set()
+
+
+class LoopbackTransport(Transport):
+    """
+    Delivers to nodes in the same process. Like the comms channel, every
+    member sees every text, including its own.
+    """
+
+    name = "loopback"
+    priority = PRIORITY_LOOPBACK
+
+    def __init__(self, hub):
+        super().__init__()
+        self.hub = hub
+        hub.members.append(self)
+
+    def reaches(self, dst):
+        return any(m.node_id == dst for m in self.hub.members)
+
+    async def send(self, text, dst=None, batch=True):
+        self.texts_sent += 1
+        for member in self.hub.members:
+            # delivered on a later loop iteration, like a real network would
+            task = asyncio.create_task(member.deliver(text))
+            self.hub.tasks.add(task)
+            task.add_done_callback(self.hub.tasks.discard)
+
+    async def close(self):
+        if self in self.hub.members:
+            self.hub.members.remove(self)
+
+
+# which end of a direct connection a hello comes from
+ROLE_CLIENT = "client"
+ROLE_SERVER = "server"
+
+
+# proves knowledge of the shared secret for this connection only: it covers
+# both nonces, so a recorded hello can't be replayed, and the sender's role,
+# so a hello can't be reflected back at the side that sent it
+def hello_proof(secret, role, verifier_nonce, sender_nonce, node_id):
+    msg = f"{role}:{verifier_nonce}:{sender_nonce}:{node_id}"
+    return hmac.new(secret.encode(), msg.encode(), hashlib.sha256).hexdigest()
+
+
+class DirectTransport(Transport):
+    """
+    Newline delimited texts over TCP straight to peers on the same host or
+    LAN. Each side challenges the other on connect, and a peer is only
+    learned from a hello signed with the shared secret.
+    """
+
+    name = "direct"
+    priority = PRIORITY_DIRECT
+
+    def __init__(self, secret, host="127.0.0.1", port=0, peers=(), reconnect_secs=10.0):
+        super().__init__()
+        if not secret:
+            raise ValueError("A direct transport needs a shared secret")
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.peer_addrs = list(peers)
+        self.reconnect_secs = reconnect_secs
+        self.server = None
+        # peer node id -> stream writer
+        self.writers = {}
+        self.tasks = set()
+
+    def reaches(self, dst):
+        return dst in self.writers
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._on_connect, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        for host, port in self.peer_addrs:
+            self._spawn(self._connect(host, port))
+
+    async def _connect(self, host, port):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                await asyncio.sleep(self.reconnect_secs)
+                continue
+            await self._serve(reader, writer, ROLE_CLIENT)
+            await asyncio.sleep(self.reconnect_secs)
+
+    async def _on_connect(self, reader, writer):
+        self.tasks.add(asyncio.current_task())
+        try:
+            await self._serve(reader, writer, ROLE_SERVER)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.tasks.discard(asyncio.current_task())
+
+    async def _serve(self, reader, writer, role):
+        peer = None
+        nonce = secrets.token_hex(16)
+        peer_nonce = None
+        peer_role = ROLE_SERVER if role == ROLE_CLIENT else ROLE_CLIENT
+        try:
+            writer.write(f"{NONCE_PREFIX}{nonce}\n".encode())
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode().rstrip("\n")
+                if text.startswith(NONCE_PREFIX) and peer_nonce is None:
+                    peer_nonce = text[len(NONCE_PREFIX):]
+                    # our own challenge echoed back, to get us to answer it
+                    if peer_nonce == nonce:
+                        break
+                    proof = hello_proof(self.secret, role, peer_nonce, nonce, self.node_id)
+                    writer.write(f"{HELLO_PREFIX}{self.node_id}:{proof}\n".encode())
+                    await writer.drain()
+                    continue
+                if text.startswith(HELLO_PREFIX) and peer is None and peer_nonce is not None:
+                    claimed, _, proof = text[len(HELLO_PREFIX):].rpartition(":")
+                    expected = hello_proof(self.secret, peer_role, nonce, peer_nonce, claimed)
+                    if claimed == self.node_id or \
+                            not hmac.compare_digest(proof.encode(), expected.encode()):
+                        print(f"Direct peer failed to authenticate as {claimed}")
+                        break
+                    peer = claimed
+                    self.writers[peer] = writer
+                    continue
+                # nothing is taken from a peer that hasn't proven who it is
+                if peer is None:
+                    break
+                await self.deliver(text)
+        # ValueError covers lines over the reader's limit and bad utf-8
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            if peer and self.writers.get(peer) is writer:
+                del self.writers[peer]
+            writer.close()
+
+    async def send(self, text, dst=None, batch=True):
+        self.texts_sent += 1
+        if dst in self.writers:
+            writers = [self.writers[dst]]
+        else:
+            writers = list(self.writers.values())
+        data = (text + "\n").encode()
+        for writer in writers:
+            try:
+                writer.write(data)
+                await writer.drain()
+            except OSError:
+                pass
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for writer in list(self.writers.values()):
+            writer.close()
+        self.writers = {}
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+import re
+import time
+
+
+#list of trigger words for dudebot to auto respond to
+OPINION_WORDS = [
+    "opinion",
+    "think",
+    "assessment",
+    "assumption",
+    "attitude",
+    "conclusion",
+    "feeling",
+    "idea",
+    "impression",
+    "judgement",
+    "mind",
+    "notion",
+    "pov",
+    "reaction",
+    "sentiment",
+    "speculate",
+    "speculation",
+    "theory",
+    "thought",
+    "view",
+    "viewpoint"
+]
+
+BIG_WORDS = [
+    "big",
+    "large",
+    "huge",
+    "ginormous",
+    "colossal",
+    "considerable",
+    "enormous",
+    "fat",
+    "full",
+    "gigantic",
+    "hefty",
+    "immense",
+    "massive",
+    "sizable",
+    "substantial",
+    "tremendous",
+    "vast",
+    "obese",
+    "lorge",
+    "rotund",
+    "gargantuan"
+]
+
+#how a trigger word has to line up with the words around it
+BOUNDARY_NONE = "none"      # matches anywhere, "mind" fires on "reminder"
+BOUNDARY_PREFIX = "prefix"  # must start a word, "think" still fires on "thinking"
+BOUNDARY_WORD = "word"      # must be a whole word
+
+#loosest first
+BOUNDARIES = [BOUNDARY_NONE, BOUNDARY_PREFIX, BOUNDARY_WORD]
+
+
+def _boundary_tail(word, boundary):
+    #boundaries are checked after the word so every trigger shares one trie;
+    #the fixed width lookbehind looks at the character before the word
+    if boundary == BOUNDARY_NONE:
+        return ""
+    before = r"(?<!\w" + "." * len(word) + ")"
+    if boundary == BOUNDARY_PREFIX:
+        return before
+    if boundary == BOUNDARY_WORD:
+        return before + r"(?!\w)"
+    raise ValueError(f"Unknown boundary mode {boundary}")
+
+
+def _boundary_ok(text, start, end, boundary):
+    if boundary == BOUNDARY_NONE:
+        return True
+    if start > 0 and (text[start - 1].isalnum() or text[start - 1] == "_"):
+        return False
+    if boundary == BOUNDARY_WORD and end < len(text):
+        return not (text[end].isalnum() or text[end] == "_")
+    return True
+
+
+def _trie_pattern(tails):
+    trie = {}
+    for word, tail in tails.items():
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[None] = tail
+
+    def build(node):
+        alts = [re.escape(c) + build(node[c]) for c in sorted(k for k in node if k is not None)]
+        #the end of a word goes last so longer triggers are tried first
+        if None in node:
+            alts.append(node[None])
+        if len(alts) == 1:
+            return alts[0]
+        return "(?:" + "|".join(alts) + ")"
+
+    return build(trie)
+
+
+class TriggerMatcher:
+    """
+    Compiles every trigger word from every category into one trie shaped
+    regex so a message is scanned once instead of once per trigger word.
+    """
+
+    def __init__(self):
+        self.categories = {}
+        self._regex = None
+        self._word_to_categories = {}
+        self._prefixes = {}
+
+    def add(self, category, words, boundary=BOUNDARY_NONE):
+        if isinstance(words, str):
+            words = [words]
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"Unknown boundary mode {boundary}")
+        self.categories[category] = ([w.lower() for w in words], boundary)
+        self._regex = None
+        return self
+
+    def compile(self):
+        loosest = {}
+        owners = {}
+        for category, (words, boundary) in self.categories.items():
+            for word in words:
+                if not word:
+                    continue
+                rank = BOUNDARIES.index(boundary)
+                loosest[word] = min(loosest.get(word, rank), rank)
+                owners.setdefault(word, []).append((category, boundary))
+
+        #a word shared by categories with different boundaries is compiled
+        #with the loosest one and the stricter categories are checked on a hit
+        tails = {}
+        self._word_to_categories = {}
+        for word, rank in loosest.items():
+            boundary = BOUNDARIES[rank]
+            tails[word] = _boundary_tail(word, boundary)
+            always = {c for c, b in owners[word] if b == boundary}
+            checked = [(c, b) for c, b in owners[word] if b != boundary]
+            self._word_to_categories[word] = (always, checked)
+
+        #the regex reports the longest trigger at a position, so shorter ones
+        #it swallowed are checked by hand on a hit
+        self._prefixes = {}
+        for word in loosest:
+            shorter = [(word[:i], BOUNDARIES[loosest[word[:i]]])
+                       for i in range(1, len(word)) if word[:i] in loosest]
+            if shorter:
+                self._prefixes[word] = shorter
+        if tails:
+            self._regex = re.compile(_trie_pattern(tails))
+        else:
+            self._regex = re.compile(r"(?!x)x")
+        return self
+
+    def match(self, text):
+        """
+        Returns the set of categories with at least one trigger in text.
+        text is expected to already be lowercased.
+        """
+        if self._regex is None:
+            self.compile()
+        found = set()
+        total = len(self.categories)
+        search = self._regex.search
+        lookup = self._word_to_categories
+        prefixes = self._prefixes
+        pos = 0
+        #restart one character after each hit so overlapping triggers
+        #are not swallowed by the previous match
+        while len(found) < total:
+            m = search(text, pos)
+            if not m:
+                break
+            start, word = m.start(), m.group()
+            always, checked = lookup[word]
+            found |= always
+            for category, boundary in checked:
+                if _boundary_ok(text, start, m.end(), boundary):
+                    found.add(category)
+            for prefix, loosest in prefixes.get(word, ()):
+                end = start + len(prefix)
+                if not _boundary_ok(text, start, end, loosest):
+                    continue
+                always, checked = lookup[prefix]
+                found |= always
+                for category, boundary in checked:
+                    if _boundary_ok(text, start, end, boundary):
+                        found.add(category)
+            pos = start + 1
+        return found
+
+
+def default_matcher():
+    m = TriggerMatcher()
+    m.add("dude", "dude")
+    m.add("thinking", "mmm")
+    m.add("opinion", OPINION_WORDS, boundary=BOUNDARY_PREFIX)
+    m.add("big", BIG_WORDS, boundary=BOUNDARY_PREFIX)
+    m.add("morb", "morb")
+    m.add("test", "test")
+    m.add("quote", "’")
+    return m.compile()
+
+
+#the original on_message checks, one substring scan per trigger word
+def list_scan(message_lower):
+    found = set()
+    if "dude" in message_lower:
+        found.add("dude")
+    if "mmm" in message_lower:
+        found.add("thinking")
+    if any(word in message_lower for word in OPINION_WORDS):
+        found.add("opinion")
+    if any(word in message_lower for word in BIG_WORDS):
+        found.add("big")
+    if "morb" in message_lower:
+        found.add("morb")
+    if "test" in message_lower:
+        found.add("test")
+    if "’" in message_lower:
+        found.add("quote")
+    return found
+
+
+SAMPLE_MESSAGES = [
+    "hey has anyone seen the new patch notes yet",
+    "lol",
+    "i don't know man, that's a pretty big ask for a tuesday",
+    "mmm not sure, let me get back to you after lunch",
+    "dude what",
+    "the build is failing again on the raspberry pi, can someone take a look " * 3,
+    "morbin time",
+    "can’t make it tonight",
+    "just a reminder that the meeting got moved",
+]
+
+
+def benchmark(n=20000):
+    matcher = default_matcher()
+    messages = [m.lower() for m in SAMPLE_MESSAGES]
+    for name, func in [("list scan", list_scan), ("compiled", matcher.match)]:
+        start = time.perf_counter()
+        for _ in range(n):
+            for m in messages:
+                func(m)
+        elapsed = time.perf_counter() - start
+        per_msg = elapsed / (n * len(messages)) * 1e6
+        print(f"{name:>10}: {per_msg:.2f} us/message")
+
+
+def main():
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
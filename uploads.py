@@ -0,0 +1,125 @@
+import asyncio
+import collections
+import hashlib
+import io
+import time
+from metrics import REGISTRY
+
+#discord attachment links stop working after about a day
+UPLOAD_TTL_SECS = 12 * 60 * 60
+MAX_UPLOADS = 64
+
+#frames whose 64 bit average hashes differ in at most this many bits are
+#taken to be the same picture, for callers that ask for it
+NEAR_DUPLICATE_BITS = 3
+#the hash can't see small changes like the LED colour, so a near match is
+#only trusted for a few secs after the upload it points at
+NEAR_DUPLICATE_TTL_SECS = 10.0
+
+
+#64 bit average hash of a JPEG: shrink to 8x8 greyscale and set a bit for
+#every pixel brighter than the mean; None without Pillow
+def average_hash(image):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    img = Image.open(io.BytesIO(image))
+    #lets the JPEG decoder skip most of the work for a tiny output
+    img.draft('L', (64, 64))
+    pixels = img.convert('L').resize((8, 8)).tobytes()
+    mean = sum(pixels) / len(pixels)
+    return sum(1 << i for i, v in enumerate(pixels) if v > mean)
+
+
+class Upload:
+    def __init__(self, url, size, ahash, group, stored, expires):
+        self.url = url
+        self.size = size
+        self.ahash = ahash
+        self.group = group
+        self.stored = stored
+        self.expires = expires
+
+
+class UploadCache:
+    """
+    Remembers the attachment URL of every image uploaded recently, by the
+    sha256 of its bytes, so the same picture is linked instead of sent again.
+    Callers can opt in to reusing a near identical picture from the last
+    near_ttl secs too.
+    """
+
+    def __init__(self, ttl=UPLOAD_TTL_SECS, max_uploads=MAX_UPLOADS,
+                 near_bits=NEAR_DUPLICATE_BITS, near_ttl=NEAR_DUPLICATE_TTL_SECS,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.max_uploads = max_uploads
+        self.near_bits = near_bits
+        self.near_ttl = near_ttl
+        self.clock = clock
+        #digest -> Upload, oldest first
+        self.uploads = collections.OrderedDict()
+
+    def fingerprint(self, image, near=False):
+        digest = hashlib.sha256(image).hexdigest()
+        ahash = None
+        if near and self.near_bits is not None and digest not in self.uploads:
+            try:
+                ahash = average_hash(image)
+            except Exception:
+                pass
+        return digest, ahash
+
+    def _expire(self):
+        now = self.clock()
+        for digest in [d for d, u in self.uploads.items() if u.expires <= now]:
+            del self.uploads[digest]
+
+    #near matches only count within a group, the hash can't tell a thumbnail
+    #from the full size picture of the same scene
+    def lookup(self, digest, ahash=None, group=None):
+        self._expire()
+        if digest in self.uploads:
+            return self.uploads[digest]
+        if ahash is None:
+            return None
+        #the newest close match, the scene may have drifted since older ones
+        recent = self.clock() - self.near_ttl
+        for upload in reversed(self.uploads.values()):
+            if upload.stored < recent:
+                break
+            if upload.group != group or upload.ahash is None:
+                continue
+            if bin(upload.ahash ^ ahash).count('1') <= self.near_bits:
+                return upload
+        return None
+
+    def store(self, digest, ahash, url, size, group=None):
+        now = self.clock()
+        self.uploads[digest] = Upload(url, size, ahash, group, now, now + self.ttl)
+        self.uploads.move_to_end(digest)
+        while len(self.uploads) > self.max_uploads:
+            self.uploads.popitem(last=False)
+
+    async def upload(self, image, send, group=None, near=False):
+        """
+        Returns (url, reused) for image, only calling send(), which uploads
+        it and returns the attachment URL, if no recent upload matches. Only
+        exact copies match unless near is set.
+        """
+        loop = asyncio.get_running_loop()
+        digest, ahash = await loop.run_in_executor(None, self.fingerprint, image, near)
+        match = self.lookup(digest, ahash, group)
+        if match:
+            REGISTRY.incr('uploads.reused')
+            REGISTRY.incr('uploads.bytes_saved', len(image))
+            return match.url, True
+        url = await send()
+        REGISTRY.incr('uploads.sent')
+        REGISTRY.incr('uploads.bytes_sent', len(image))
+        self.store(digest, ahash, url, len(image), group)
+        return url, False
+
+    def invalidate(self):
+        self.uploads.clear()
@@ -0,0 +1,202 @@
+import base64
+import collections
+import json
+import os
+import time
+import uuid
+import zlib
+
+
+WIRE_VERSION = 1
+
+# ~1:<armored packet>
+COMPACT_PREFIX = f"~{WIRE_VERSION}:"
+# ~1f:<fragment set id>:<index>:<count>:<armored chunk>
+FRAGMENT_PREFIX = f"~{WIRE_VERSION}f:"
+
+# discord refuses messages longer than this
+MAX_MESSAGE_CHARS = 2000
+
+FRAGMENT_TTL_SECS = 30.0
+MAX_PARTIAL_PACKETS = 64
+
+# payload flags
+FLAG_ID_UUID = 1
+FLAG_BACKLINK_UUID = 2
+FLAG_COMPRESSED = 4
+
+SHORT_KEYS = {
+    "id": "i",
+    "src": "s",
+    "dst": "d",
+    "endpoint": "e",
+    "body": "b",
+    "backlink": "l",
+    "ttl": "t",
+}
+LONG_KEYS = {v: k for k, v in SHORT_KEYS.items()}
+
+
+def _uuid_bytes(s):
+    try:
+        u = uuid.UUID(s)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    # only take the 16 byte form if it round trips to the same string
+    return u.bytes if str(u) == s else None
+
+
+def pack(fields):
+    """
+    Encodes a dict of packet fields into one compact frame, ignoring the
+    discord message limit.
+    """
+    flags = 0
+    head = b""
+    rest = {}
+    for k, v in fields.items():
+        if v == "" and k in ("id", "backlink"):
+            continue
+        # only responses that may be cached carry a ttl
+        if k == "ttl" and not v:
+            continue
+        if k in ("id", "backlink"):
+            raw = _uuid_bytes(v)
+            if raw is not None:
+                flags |= FLAG_ID_UUID if k == "id" else FLAG_BACKLINK_UUID
+                continue
+        rest[SHORT_KEYS.get(k, k)] = v
+    if flags & FLAG_ID_UUID:
+        head += _uuid_bytes(fields["id"])
+    if flags & FLAG_BACKLINK_UUID:
+        head += _uuid_bytes(fields["backlink"])
+
+    data = json.dumps(rest, separators=(",", ":")).encode()
+    compressed = zlib.compress(data, 9)
+    if len(compressed) < len(data):
+        flags |= FLAG_COMPRESSED
+        data = compressed
+
+    payload = bytes([flags]) + head + data
+    return COMPACT_PREFIX + base64.b85encode(payload).decode()
+
+
+def unpack(armored):
+    payload = base64.b85decode(armored)
+    flags = payload[0]
+    pos = 1
+    fields = {}
+    if flags & FLAG_ID_UUID:
+        fields["id"] = str(uuid.UUID(bytes=payload[pos:pos + 16]))
+        pos += 16
+    if flags & FLAG_BACKLINK_UUID:
+        fields["backlink"] = str(uuid.UUID(bytes=payload[pos:pos + 16]))
+        pos += 16
+    data = payload[pos:]
+    if flags & FLAG_COMPRESSED:
+        data = zlib.decompress(data)
+    for k, v in json.loads(data).items():
+        fields[LONG_KEYS.get(k, k)] = v
+    return fields
+
+
+def encode(fields, max_chars=MAX_MESSAGE_CHARS):
+    """
+    Encodes packet fields into as many messages as it takes to fit under
+    max_chars each.
+    """
+    frame = pack(fields)
+    if len(frame) <= max_chars:
+        return [frame]
+
+    armored = frame[len(COMPACT_PREFIX):]
+    set_id = os.urandom(4).hex()
+    # generous header estimate so the chunk size is fixed up front
+    header_len = len(FRAGMENT_PREFIX) + len(set_id) + 2 * 6 + 3
+    chunk_len = max_chars - header_len
+    chunks = [armored[i:i + chunk_len] for i in range(0, len(armored), chunk_len)]
+    return [f"{FRAGMENT_PREFIX}{set_id}:{i}:{len(chunks)}:{c}"
+            for i, c in enumerate(chunks)]
+
+
+def encode_json(fields):
+    """
+    The legacy wire format, for nodes that don't understand compact frames.
+    """
+    return [json.dumps(fields)]
+
+
+# legacy nodes send bare json objects, one per message
+def is_json(text):
+    return text.startswith("{")
+
+
+def decode(text):
+    """
+    Decodes a single compact frame or legacy json packet into its fields.
+    Returns None for anything else, including fragments.
+    """
+    try:
+        if text.startswith(COMPACT_PREFIX):
+            return unpack(text[len(COMPACT_PREFIX):])
+        if is_json(text):
+            return json.loads(text)
+    except Exception:
+        pass
+    return None
+
+
+class Reassembler:
+    """
+    Decodes incoming messages, holding on to fragments until the whole
+    packet has arrived. Incomplete sets are dropped after a while.
+    """
+
+    def __init__(self, ttl=FRAGMENT_TTL_SECS, max_partial=MAX_PARTIAL_PACKETS,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.max_partial = max_partial
+        self.clock = clock
+        # set id -> (first seen, count, {index: chunk})
+        self.partial = collections.OrderedDict()
+        self.dropped = 0
+
+    def _expire(self, now):
+        while self.partial:
+            first_seen = next(iter(self.partial.values()))[0]
+            if first_seen >= now - self.ttl and len(self.partial) <= self.max_partial:
+                break
+            self.partial.popitem(last=False)
+            self.dropped += 1
+
+    def feed(self, text):
+        """
+        Returns (fields, wire size in chars) once a packet is complete,
+        otherwise None.
+        """
+        if not text.startswith(FRAGMENT_PREFIX):
+            fields = decode(text)
+            return (fields, len(text)) if fields is not None else None
+
+        try:
+            set_id, index, count, chunk = text[len(FRAGMENT_PREFIX):].split(":", 3)
+            index, count = int(index), int(count)
+        except ValueError:
+            return None
+
+        now = self.clock()
+        if set_id not in self.partial:
+            self.partial[set_id] = (now, count, {})
+        chunks = self.partial[set_id][2]
+        chunks[index] = chunk
+        self._expire(now)
+
+        if any(i not in chunks for i in range(count)):
+            return None
+        self.partial.pop(set_id, None)
+        armored = "".join(chunks[i] for i in range(count))
+        size = len(armored) + count * (len(text) - len(chunk))
+        try:
+            return unpack(armored), size
+        except Exception:
+            return None